@@ -1,54 +1,247 @@
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, FeatureNotFound, SoupStrainer
 import re
 import json
 from urllib.parse import urljoin, urlparse
 import time
 import logging
 import argparse
-from typing import Optional, Tuple, Any, Dict, List
+import shelve
+import functools
+import codecs
+from collections import OrderedDict, defaultdict
+import threading
+import queue
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Optional, Tuple, Any, Dict, List, Iterable, Mapping
 import os
 from io import BytesIO
 from PIL import Image as PILImage
 import openpyxl
 from openpyxl.drawing.image import Image as OpenpyxlImage
-from openpyxl.utils import get_column_letter
+from openpyxl.utils import get_column_letter, column_index_from_string
 from openpyxl.styles import Alignment
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
-from selenium.common.exceptions import WebDriverException, TimeoutException
+from selenium.common.exceptions import WebDriverException, TimeoutException, InvalidSessionIdException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
 from openpyxl.workbook import Workbook
 from openpyxl.worksheet.worksheet import Worksheet
 
+# orjson は任意依存: インストールされていれば高速なC実装でJSONを解析する
+# (orjson.JSONDecodeError は json.JSONDecodeError のサブクラス)
+try:
+    import orjson
+
+    def json_loads(text: str) -> Any:
+        """orjson.loads は str のサブクラス (bs4 の NavigableString 等) を受け付けないため、str に変換して渡す"""
+        return orjson.loads(str(text))
+except ImportError:
+    orjson = None
+    json_loads = json.loads
+
+# jmespath は任意依存: インストールされていればプリコンパイル済みの式でJSONを辿る
+try:
+    import jmespath
+except ImportError:
+    jmespath = None
+
+# google-re2 は任意依存: インストールされていれば除外パターンの判定に線形時間のRE2エンジンを使う
+try:
+    import re2 as fast_re
+except ImportError:
+    fast_re = re
+
+# requests-cache は任意依存: インストールされていればHTTPレスポンスをディスクにキャッシュする
+try:
+    import requests_cache
+except ImportError:
+    requests_cache = None
+
+# tqdm は任意依存: インストールされていれば進捗バーを表示する
+try:
+    from tqdm import tqdm
+except ImportError:
+    tqdm = None
+
+# selectolax (Lexbor) は任意依存: 未インストール時は BeautifulSoup のみで解析する
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+# lxml も任意依存: selectolax がない場合の高速パス (XPath) に使う
+try:
+    from lxml import etree
+    from lxml import html as lxml_html
+except ImportError:
+    etree = None
+    lxml_html = None
+
 # --- 設定 ---
 HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36'}
 DEFAULT_IMAGE_WIDTH = 100
 DEBUG_LOG_FILE = "scraping_debug.log"
 REQUEST_TIMEOUT = 20
-SELENIUM_TIMEOUT = 30
+IMAGE_REQUEST_TIMEOUT = 15
+META_CHARSET_SCAN_BYTES = 4096  # <meta charset> を探すHTML先頭のバイト数
+HTML_PARSER = 'lxml'          # C実装の高速パーサー (未インストール時は html.parser にフォールバック)
+FALLBACK_HTML_PARSER = 'html.parser'
+SELENIUM_TIMEOUT = 15
+SELENIUM_CACHE_SIZE = 512     # Seleniumでの抽出結果をURLごとに保持する件数
+SELENIUM_WAIT_TIMEOUT = 5     # 画像情報を含む要素の出現を待つ最大秒数
+SELENIUM_DRIVERS = 1          # 同時に起動するChromeの最大数 (Seleniumが必要な行を並列に処理する)
+MAX_IMAGE_BYTES = 20 * 1024 * 1024  # これを超える画像 (Content-Length) はダウンロードしない
+# 画像リクエストの Accept。コンテンツネゴシエーションに対応したCDNからはより小さいWebPを受け取る
+# (AVIF は Pillow のバージョンによってはデコードできないため明示しない)
+IMAGE_ACCEPT_HEADER = 'image/webp,image/jpeg,image/png,image/*;q=0.8'
+IMAGE_MODE_CONVERSIONS_BEFORE_RESIZE = {'P': 'RGBA'}              # リサイズ前に変換する画像モード
+IMAGE_MODE_CONVERSIONS_AFTER_RESIZE = {'CMYK': 'RGB', 'LA': 'RGBA'} # リサイズ後に変換する画像モード
+# 元の形式のまま保存する形式 (それ以外はPNG)。openpyxl は保存時に gif/jpeg/png 以外をPNGへ再エンコードするため、
+# BMP/TIFF 等はここでPNGにしておき、ブック保存時に画像を開き直して変換する処理を避ける
+EMBEDDABLE_FORMATS = frozenset({'JPEG', 'PNG'})
+PASSTHROUGH_FORMATS = ('JPEG', 'PNG')      # 再エンコードせずにそのまま埋め込める形式
+PASSTHROUGH_MODES = ('RGB', 'RGBA', 'L')
+PASSTHROUGH_WIDTH_TOLERANCE = 1.05         # 目標幅の何倍までをリサイズ不要とみなすか
+DRAFT_OVERSAMPLE = 2                       # JPEG draft() で残す解像度 (目標サイズに対する倍率)
+RESIZE_REDUCING_GAP = 2.0                  # Pillowの2段階縮小 (品質をほぼ保ったまま大きな画像の縮小を高速化)
+IMAGE_CACHE_SIZE = 256                     # 処理済み画像をメモリに保持する件数 (同一画像URLの再ダウンロード防止)
+HTTP_CACHE_NAME = "scraping_cache"         # requests-cache のSQLiteファイル名 (拡張子なし)
+HTTP_CACHE_EXPIRE_SECONDS = 24 * 60 * 60
+HTTP_CACHE_CONTENT_TYPES = ('text/html', 'application/xhtml+xml') # HTTPキャッシュに保存するレスポンス (HTMLページのみ)
+RESULT_CACHE_FILE = "scraping_results"     # 解析結果 (ページURL -> 画像URL) を保存する shelve ファイル
+RESULT_CACHE_EXPIRE_SECONDS = HTTP_CACHE_EXPIRE_SECONDS # 解析結果の有効期限 (商品画像の差し替えを拾うため、HTTPキャッシュと揃える)
+HTTP_POOL_SIZE = 20           # ホストごとのコネクションプール数
+HTTP_MAX_RETRIES = 2
+HTTP_BACKOFF_FACTOR = 0.3
+HTTP_RETRY_STATUSES = (502, 503, 504)    # 一時的なゲートウェイエラーは再試行する
 POST_URL_SLEEP = 1.0
+MAX_WORKERS = 8               # URL取得・画像DLを並列実行するスレッド数
+PROGRESS_PRINT_INTERVAL = 0.25 # tqdm がない場合に進捗行を書き直す最小間隔 (秒)
+CPU_PROCESSES = 0             # HTML解析・画像リサイズ用のプロセス数 (0: プロセスプールを使わない)
 
 # --- Selenium Only ドメインリスト ---
-SELENIUM_ONLY_DOMAINS = [
+SELENIUM_ONLY_DOMAINS = (
     "ebay.com",
     "mercari.com", # mercariはrequestsでも試行するが、Seleniumが必要な場合が多い
     "2ndstreet.jp", # 同上
+)
+# requestsでは画像が見つからずSeleniumで見つかった回数がこの値に達したドメインは、同じ実行中は以降Seleniumを直接使う
+SELENIUM_LEARN_THRESHOLD = 2
+
+# --- Seleniumで待機する要素 (出現した時点で page_source を取得する) ---
+SELENIUM_READY_SELECTOR = 'meta[property="og:image"], script[type="application/ld+json"]'
+# サイト固有ロジックが読む画像要素 (該当サイトでは汎用のメタタグではなく、この要素の出現を待つ)
+SELENIUM_SITE_READY_SELECTORS = {
+    "mercari.com": 'img[src*="static.mercdn.net"], img[alt*="のサムネイル"]',
+    "2ndstreet.jp": '#goodsImages img',
+    "okoku.jp": '#product_image .bxslider img',
+    "amazon.": '#imgTagWrapperId img, #landingImage',
+    "ebay.com": '.ux-image-carousel img, #icImg',
+}
+
+# --- Seleniumで読み込まないリソース (CDP Network.setBlockedURLs のワイルドカード形式) ---
+SELENIUM_BLOCKED_URL_PATTERNS = (
+    # 画像 (og:image等はHTML内のURLを読むだけで、画像本体は不要)
+    "*.jpg", "*.jpeg", "*.png", "*.gif", "*.webp", "*.avif", "*.svg", "*.ico",
+    # フォント
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    # 動画・音声
+    "*.mp4", "*.webm", "*.m3u8", "*.mp3",
+    # スタイルシート
+    "*.css",
+    # 広告・アクセス解析 (ページの描画やHTMLの内容には影響しない)
+    "*doubleclick.net*", "*google-analytics.com*", "*googletagmanager.com*", "*googlesyndication.com*",
+)
+
+# --- サイト固有の解析ロジックを持つドメイン (BeautifulSoupで解析) ---
+SITE_SPECIFIC_DOMAINS = (
+    "okoku.jp",
+    "2ndstreet.jp",
+    "mercari.com",
+    "amazon.",
+)
+
+# --- 画像URL判定用パターン (モジュール読み込み時に一度だけコンパイル) ---
+FALLBACK_EXCLUDE_PATTERNS = [
+    ".gif", ".svg", "ads", "icon", "logo", "sprite", "avatar", "spinner",
+    "loading", "pixel", "fls-fe.amazon", "transparent", "spacer", "dummy",
+    "captcha", "_tn.", "_mn.", "_thumb.", "/thumb", "-small.", ".small",
+    "nav_", "banner", "profile", "badge", "button", "rating"
 ]
+FALLBACK_EXCLUDE_EXTENSIONS = ['.php', '.aspx', '.jsp'] # スクリプトを示す拡張子は除外
+# 大文字小文字の区別はインラインフラグ (?i) で指定する (re / re2 の両方で有効)
+_EXCLUDE_RE = fast_re.compile('(?i)' + '|'.join(re.escape(p) for p in FALLBACK_EXCLUDE_PATTERNS))
+_EXCLUDE_EXT_RE = fast_re.compile('(?i)(?:' + '|'.join(re.escape(e) for e in FALLBACK_EXCLUDE_EXTENSIONS) + r')$')
+HTTP_URL_PREFIXES = ('http://', 'https://')
+ABSOLUTE_URL_PREFIXES = HTTP_URL_PREFIXES + ('data:',) # 絶対パスとみなす (変換不要な) 接頭辞
+_NEXT_DATA_RE = re.compile(r'<script[^>]*\bid=["\']__NEXT_DATA__["\'][^>]*>(.*?)</script>', re.DOTALL)
+_MERCARI_RE = re.compile(r'https://static\.mercdn\.net/item/detail/orig/photos/[^"\']+?')
+_MERCARI_THUMBNAIL_ALT_RE = re.compile('のサムネイル') # 商品画像の alt 属性 (lambda の呼び出しを避けるため正規表現で照合)
+_META_CHARSET_RE = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([A-Za-z0-9_.:-]+)', re.IGNORECASE)
+_AMAZON_SIZE_SUFFIX_RE = re.compile(r'\._[A-Z]{2}_\w+_\.')
+# Mercari の __NEXT_DATA__ から先頭の商品画像を取り出す式 (jmespath がない場合は .get() を連ねて辿る)
+_MERCARI_PHOTO_EXPR = jmespath.compile('props.pageProps.item.photos[0]') if jmespath is not None else None
+
+# --- lxml 高速パス用XPath (モジュール読み込み時に一度だけコンパイル) ---
+if etree is not None:
+    _META_IMAGE_XP = etree.XPath('//meta[@property="og:image" or @name="twitter:image"]')
+    _LD_JSON_XP = etree.XPath('//script[@type="application/ld+json"]/text()', smart_strings=False) # 親要素への参照を持たない素の str を返す
+    _IMG_XP = etree.XPath('//img')
+
+# requestsで取得したHTMLのこれらのメタタグに空でない content があれば、画像情報はJavaScriptに依存しないとみなし
+# Seleniumで再試行しない (HTMLを文字列検索すると og:image:width やスクリプト内の文字列にも一致するため、解析結果で判定する)
+# (サイト固有ロジックを持つドメインは対象外。買取王国のロゴの og:image のように、静的HTMLの値を意図的に除外して
+#  JavaScriptで描画される要素から画像を探すため)
+STATIC_IMAGE_MARKERS = ('og:image', 'twitter:image')
+
+# サイト固有ロジックが <div> 等のコンテナ要素を辿るドメイン (SoupStrainer で絞り込まずに全体を解析)
+FULL_DOM_DOMAINS = (
+    "okoku.jp",
+    "2ndstreet.jp",
+    "amazon.",
+)
+# 画像URLの抽出に必要なタグ (meta / JSON-LD・__NEXT_DATA__ の script / img) だけを解析する
+IMAGE_TAGS_STRAINER = SoupStrainer(['meta', 'script', 'img'])
+
+# Amazonのメイン画像コンテナID (優先度順)
+AMAZON_IMAGE_CONTAINER_IDS = ['imgTagWrapperId', 'landingImage', 'ivLargeImage', 'main-image-container']
 
 # --- 固定する列ヘッダー名 ---
 URL_HEADER_NAME = "URL"
 IMAGE_URL_HEADER_NAME = "(work)画像URL"
 IMAGE_EMBED_COL_LETTER = 'E' # 画像埋め込み列 (E列)
 HYPHEN_COL_LETTER = 'D'      # ハイフン列 (D列)
+# 列番号は起動時に1回だけ変換しておく (各関数は列番号を受け取り、列名が必要な箇所でのみ変換する)
+IMAGE_EMBED_COL_IDX = column_index_from_string(IMAGE_EMBED_COL_LETTER)
+HYPHEN_COL_IDX = column_index_from_string(HYPHEN_COL_LETTER)
+# 画像埋め込みセルの配置 (Alignment は不変オブジェクトのため全行で共有する)
+CENTER_ALIGNMENT = Alignment(horizontal='center', vertical='center')
 
 # ============================================
-# 1. WebDriver 管理 (共通基盤)
+# 1. WebDriver / HTTPセッション管理 (共通基盤)
 # ============================================
 class WebDriverManager:
-    """Selenium WebDriverの初期化と終了を管理するクラス"""
-    def __init__(self):
+    """
+    Selenium WebDriverの初期化と終了を管理するクラス。
+    最大 pool_size 個のChromeを保持し、acquire_driver() / release_driver() でスレッドに貸し出す
+    (WebDriverの1セッションは複数スレッドで同時に使えないため)。
+    Chromeの起動は数秒かかるため、貸し出す空きがない場合に限り1つずつ起動する
+    (requestsだけで全行を処理できた場合は起動しない)。
+    """
+    def __init__(self, pool_size: int = SELENIUM_DRIVERS):
         self.options = self._default_options()
-        self.driver: Optional[webdriver.Chrome] = None
+        self.pool_size = max(1, pool_size)
+        self._drivers: List[webdriver.Chrome] = []
+        self._idle: "queue.Queue[webdriver.Chrome]" = queue.Queue()
+        self._starting = 0          # 起動処理中のChromeの数
+        self._start_failed = False  # 起動に失敗した場合は以降新たに起動しない
+        self._lock = threading.Lock()
 
     def _default_options(self) -> Options:
         """WebDriverのデフォルトオプションを設定"""
@@ -63,21 +256,95 @@ class WebDriverManager:
         options.add_argument(f"user-agent={HEADERS['User-Agent']}")
         # Chrome自身のログを抑制 (効果は限定的)
         options.add_experimental_option('excludeSwitches', ['enable-logging'])
+        # 必要なのはHTMLのみのため、画像とCSSの読み込みを無効化
+        options.add_experimental_option("prefs", {
+            "profile.managed_default_content_settings.images": 2,
+            "profile.managed_default_content_settings.stylesheets": 2,
+        })
+        # onload ではなく DOMContentLoaded の時点で driver.get() から戻る
+        options.page_load_strategy = 'eager'
         return options
 
-    def __enter__(self) -> Optional[webdriver.Chrome]:
-        """WebDriverを初期化 (with文で使用)"""
+    def __enter__(self) -> "WebDriverManager":
+        """with文で使用。WebDriverはここでは起動せず、acquire_driver() で必要になった時点で起動する"""
+        return self
+
+    def acquire_driver(self) -> Optional[webdriver.Chrome]:
+        """
+        空いているWebDriverを貸し出す。空きがなく pool_size に達していなければ新たに起動し、
+        達していれば返却を待つ。利用できるWebDriverがない (起動に失敗した) 場合は None を返す。
+        使い終わったら必ず release_driver() で返却すること。
+        """
+        with self._lock:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            start_new = not self._start_failed and len(self._drivers) + self._starting < self.pool_size
+            if start_new:
+                self._starting += 1
+
+        if start_new:
+            driver = self._start_driver()
+            with self._lock:
+                self._starting -= 1
+                if driver:
+                    self._drivers.append(driver)
+                    return driver
+                self._start_failed = True
+                if not self._drivers and not self._starting:
+                    print("警告: WebDriverの初期化に失敗したため、Seleniumを利用した処理はスキップされます。")
+                    logging.warning("WebDriver initialization failed. Selenium-dependent operations will be skipped.")
+
+        # 他のスレッドが使用中のWebDriverの返却を待つ
+        while True:
+            try:
+                return self._idle.get(timeout=1.0)
+            except queue.Empty:
+                if not self.is_available():
+                    return None
+
+    def release_driver(self, driver: webdriver.Chrome):
+        """acquire_driver() で借りたWebDriverを返却する"""
+        self._idle.put(driver)
+
+    def restart_driver(self, driver: webdriver.Chrome) -> Optional[webdriver.Chrome]:
+        """セッションが失われたWebDriverを終了し、代わりを起動する (貸し出し中のまま返す。失敗時は None)"""
+        try:
+            driver.quit()
+        except Exception as e:
+            logging.debug(f"Error while quitting lost WebDriver session: {e}")
+        with self._lock:
+            if driver in self._drivers:
+                self._drivers.remove(driver)
+            self._starting += 1
+        new_driver = self._start_driver()
+        with self._lock:
+            self._starting -= 1
+            if new_driver:
+                self._drivers.append(new_driver)
+            else:
+                self._start_failed = True
+        return new_driver
+
+    def is_available(self) -> bool:
+        """WebDriverが利用可能か (未起動の場合は起動を試みる前なので True)"""
+        return not self._start_failed or bool(self._drivers) or self._starting > 0
+
+    def _start_driver(self) -> Optional[webdriver.Chrome]:
+        """WebDriverを1つ初期化する"""
         t_start = time.time()
         print("WebDriverを初期化しています (ヘッドレスモード)...")
         logging.info("WebDriverを初期化しています (ヘッドレスモード)...")
         try:
             # ここでChromeDriverのパスを指定する必要がある場合がある
-            # 例: self.driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=self.options)
+            # 例: driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=self.options)
             # または webdriver.Chrome(executable_path='/path/to/chromedriver', options=self.options)
-            self.driver = webdriver.Chrome(options=self.options)
+            driver = webdriver.Chrome(options=self.options)
+            self._block_heavy_resources(driver)
             print("WebDriverの準備が完了しました。")
             logging.info(f"WebDriverの準備が完了しました。({time.time() - t_start:.3f}s)")
-            return self.driver
+            return driver
         except WebDriverException as e:
             logging.error(f"WebDriverException: WebDriver準備失敗: {e}", exc_info=True)
             print(f"\nエラー: WebDriver準備失敗: {e}")
@@ -95,18 +362,153 @@ class WebDriverManager:
             print(f"エラー: WebDriver準備中: {e}")
         return None # エラー時は None を返す
 
+    def _block_heavy_resources(self, driver: webdriver.Chrome):
+        """CDPで画像・フォント・動画などのリクエスト自体を遮断する (HTMLの取得には不要なため)"""
+        try:
+            driver.execute_cdp_cmd('Network.enable', {})
+            driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': list(SELENIUM_BLOCKED_URL_PATTERNS)})
+            logging.debug(f"Blocking {len(SELENIUM_BLOCKED_URL_PATTERNS)} resource URL patterns via CDP.")
+        except Exception as e:
+            # CDP非対応のドライバでも処理は続行できる
+            logging.warning(f"Failed to set blocked URLs via CDP: {e}")
+
     def __exit__(self, exc_type, exc_val, exc_tb):
-        """WebDriverを終了 (with文で使用)"""
-        if self.driver:
+        """起動したすべてのWebDriverを終了 (with文で使用)"""
+        for driver in self._drivers:
             t_start = time.time()
             try:
-                self.driver.quit()
+                driver.quit()
                 print("WebDriverを終了しました。")
                 logging.info(f"WebDriverを終了しました。({time.time() - t_start:.3f}s)")
             except Exception as e:
                 logging.error(f"WebDriver終了中のエラー: {e}", exc_info=True)
                 print(f"エラー: WebDriver終了中: {e}")
-        self.driver = None
+        self._drivers.clear()
+
+# CPU処理 (HTML解析・画像リサイズ) を実行するプロセスプール。None の場合は呼び出し元スレッドで実行する
+_cpu_pool: Optional[ProcessPoolExecutor] = None
+
+def start_cpu_pool(max_processes: int, debug_mode: bool) -> Optional[ProcessPoolExecutor]:
+    """HTML解析・画像リサイズ用のプロセスプールを起動する (max_processes <= 0 なら起動しない)"""
+    global _cpu_pool
+    if max_processes <= 0:
+        return None
+    # ワーカープロセスは submit 時に必要に応じて起動されるため、fork だとスレッドプール稼働中の
+    # マルチスレッドなプロセス (ロック保持中のスレッドを含む) を複製してデッドロックし得る。spawn で起動する
+    _cpu_pool = ProcessPoolExecutor(max_workers=max_processes, mp_context=multiprocessing.get_context("spawn"),
+                                    initializer=_init_cpu_worker, initargs=(debug_mode,))
+    logging.info(f"CPU process pool started ({max_processes} processes).")
+    return _cpu_pool
+
+def shutdown_cpu_pool():
+    """プロセスプールを終了する"""
+    global _cpu_pool
+    if _cpu_pool:
+        _cpu_pool.shutdown()
+        logging.info("CPU process pool shut down.")
+    _cpu_pool = None
+
+def _init_cpu_worker(debug_mode: bool):
+    """プロセスプールの各ワーカーのロギングを親プロセスと同じ設定にする (ログファイルは追記)"""
+    setup_logging(debug_mode, reset_log_file=False)
+
+def run_cpu_task(func: Any, *args: Any) -> Any:
+    """CPU処理をプロセスプール (無効ならこのスレッド) で実行し、結果を返す"""
+    if _cpu_pool is None:
+        return func(*args)
+    return _cpu_pool.submit(func, *args).result()
+
+# 解析結果 (ページURL -> (保存時刻, 画像URL)) の永続キャッシュ。None の場合は無効
+_result_cache: Optional[shelve.Shelf] = None
+_result_cache_lock = threading.Lock()
+
+def open_result_cache(file_path: str = RESULT_CACHE_FILE):
+    """解析結果キャッシュ (shelve) を開く"""
+    global _result_cache
+    try:
+        _result_cache = shelve.open(file_path)
+        logging.info(f"Result cache opened: '{file_path}' ({len(_result_cache)} entries)")
+    except Exception as e:
+        logging.warning(f"Failed to open result cache '{file_path}': {e}")
+        _result_cache = None
+
+def close_result_cache():
+    """解析結果キャッシュを閉じる"""
+    global _result_cache
+    if _result_cache is not None:
+        with _result_cache_lock:
+            _result_cache.close()
+        logging.info("Result cache closed.")
+    _result_cache = None
+
+def result_cache_get(url: str) -> Optional[str]:
+    """キャッシュ済みの画像URLを返す (キャッシュ無効・未登録・RESULT_CACHE_EXPIRE_SECONDS を過ぎた場合は None)"""
+    if _result_cache is None:
+        return None
+    with _result_cache_lock:
+        entry = _result_cache.get(url)
+    # 時刻を持たない旧形式のエントリも期限切れとして扱い、取得し直す
+    if not isinstance(entry, tuple) or time.time() - entry[0] > RESULT_CACHE_EXPIRE_SECONDS:
+        return None
+    return entry[1]
+
+def result_cache_set(url: str, image_url: str):
+    """画像URLを保存時刻とともにキャッシュに保存する"""
+    if _result_cache is None:
+        return
+    with _result_cache_lock:
+        _result_cache[url] = (time.time(), image_url)
+
+class HostRateLimiter:
+    """ホストごとにアクセス間隔を空けるためのクラス (スレッドセーフ)"""
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next_allowed: Dict[str, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def wait(self, host: str):
+        """同じホストへの前回アクセスから interval 秒経過するまで待機する"""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_allowed[host])
+            self._next_allowed[host] = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            logging.debug(f"Rate limit: waiting {delay:.2f}s before accessing {host}")
+            time.sleep(delay)
+
+def _is_cacheable_page(response: requests.Response) -> bool:
+    """
+    HTMLページのレスポンスだけをHTTPキャッシュに保存する (requests-cache の filter_fn)。
+    画像は保存しない: 保存するには本文全体を読み込む必要があり、Content-Type / サイズの確認より先に全体をダウンロードしてしまうため。
+    """
+    return response.headers.get('content-type', '').lower().startswith(HTTP_CACHE_CONTENT_TYPES)
+
+def create_http_session(pool_size: int = HTTP_POOL_SIZE, use_cache: bool = False) -> requests.Session:
+    """
+    コネクションを再利用する requests.Session を生成する (keep-alive + プール)。
+    pool_size はワーカースレッド数以上にすること (不足するとプールから溢れた接続が毎回破棄される)。
+    use_cache=True かつ requests-cache がインストールされている場合、HTMLページのGETの結果をSQLiteにキャッシュする。
+    """
+    if use_cache and requests_cache is not None:
+        session = requests_cache.CachedSession(
+            HTTP_CACHE_NAME, backend='sqlite', expire_after=HTTP_CACHE_EXPIRE_SECONDS,
+            allowable_codes=(200,), allowable_methods=('GET', 'HEAD'), filter_fn=_is_cacheable_page,
+            stale_if_error=True) # 再取得でエラーになった場合は期限切れのキャッシュを使う
+        logging.info(f"HTTP cache enabled: '{HTTP_CACHE_NAME}.sqlite' (expires after {HTTP_CACHE_EXPIRE_SECONDS}s)")
+    else:
+        if use_cache:
+            logging.info("requests-cache is not installed. HTTP responses will not be cached.")
+        session = requests.Session()
+    session.headers.update(HEADERS)
+    # 再試行し尽くした場合も最後のレスポンスを返し、raise_for_status() でステータスコードを記録できるようにする
+    retry = Retry(total=HTTP_MAX_RETRIES, backoff_factor=HTTP_BACKOFF_FACTOR,
+                  status_forcelist=HTTP_RETRY_STATUSES, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    logging.debug(f"HTTP session created (pool size: {pool_size}, retries: {HTTP_MAX_RETRIES})")
+    return session
 
 # ============================================
 # 2. HTML/JSON 解析ヘルパー (共通基盤)
@@ -121,60 +523,79 @@ def extract_meta_name(soup: BeautifulSoup, name: str) -> Optional[str]:
     tag = soup.find('meta', attrs={'name': name})
     return tag['content'] if tag and tag.get('content') else None
 
+def _image_from_image_prop(image_prop: Any) -> Optional[str]:
+    """JSON-LDの image プロパティ (文字列 / リスト / ImageObject) からURLを取り出す"""
+    if isinstance(image_prop, str): return image_prop
+    elif isinstance(image_prop, list) and len(image_prop) > 0:
+        first_item = image_prop[0]
+        if isinstance(first_item, str): return first_item
+        elif isinstance(first_item, dict) and first_item.get('url'): return first_item['url']
+    elif isinstance(image_prop, dict) and image_prop.get('url'): return image_prop['url']
+    return None
+
 def find_image_in_json(json_obj: Any) -> Optional[str]:
-    """JSONデータ構造から再帰的に画像URLを探す"""
+    """JSONデータ構造から画像URLを探す (明示的なスタックによる深さ優先探索。再帰は使わない)"""
     if not json_obj: return None
-    image_url = None
-    if isinstance(json_obj, dict):
-        # Common patterns first
-        if 'image' in json_obj:
-            image_prop = json_obj['image']
-            if isinstance(image_prop, str): image_url = image_prop
-            elif isinstance(image_prop, list) and len(image_prop) > 0:
-                first_item = image_prop[0]
-                if isinstance(first_item, str): image_url = first_item
-                elif isinstance(first_item, dict) and first_item.get('url'): image_url = first_item['url']
-            elif isinstance(image_prop, dict) and image_prop.get('url'): image_url = image_prop['url']
-        if image_url: return image_url
-
-        # Check @graph (common in JSON-LD)
-        if '@graph' in json_obj and isinstance(json_obj['@graph'], list):
-            image_url = find_image_in_json(json_obj['@graph'])
-            if image_url: return image_url
-
-        # Recursively check other values
-        for key, value in json_obj.items():
-            # Avoid infinite loops for recursive structures if necessary
-            if key != 'image' and key != '@graph': # Avoid re-checking keys already handled
-                image_url = find_image_in_json(value)
+    stack = [json_obj]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, dict):
+            # Common patterns first
+            if 'image' in obj:
+                image_url = _image_from_image_prop(obj['image'])
                 if image_url: return image_url
 
-    elif isinstance(json_obj, list):
-        for item in json_obj:
-            image_url = find_image_in_json(item)
-            if image_url: return image_url
+            # @graph (common in JSON-LD) を先に、その他の値をキー順に探索する
+            children = [value for key, value in obj.items()
+                        if key != 'image' and key != '@graph' and isinstance(value, (dict, list))]
+            graph = obj.get('@graph')
+            if isinstance(graph, list):
+                children.insert(0, graph)
+            stack.extend(reversed(children))
+        elif isinstance(obj, list):
+            stack.extend(item for item in reversed(obj) if isinstance(item, (dict, list)))
     return None
 
-def extract_json_ld_image(soup: BeautifulSoup) -> Optional[str]:
-    """HTML内のJSON-LDスクリプトから画像URLを抽出"""
-    scripts = soup.find_all('script', type='application/ld+json')
-    for script in scripts:
-        if script.string:
+def _find_image_in_json_ld_texts(script_texts: Iterable[Optional[str]]) -> Optional[str]:
+    """JSON-LDスクリプトの文字列群から最初に見つかった画像URLを返す"""
+    for script_text in script_texts:
+        # "image" キーを含まないブロック (BreadcrumbList, FAQ 等) は解析自体を省く
+        if script_text and '"image"' in script_text:
             try:
-                json_data = json.loads(script.string)
+                json_data = json_loads(script_text)
                 image_url = find_image_in_json(json_data)
                 if image_url:
                     logging.info(f"Found JSON-LD image: {image_url[:60]}...")
                     return image_url
             except json.JSONDecodeError as e:
-                logging.warning(f"JSON-LD parsing error: {e} - Content: {script.string[:100]}...")
+                logging.warning(f"JSON-LD parsing error: {e} - Content: {script_text[:100]}...")
             except Exception as e:
                 logging.warning(f"Error processing JSON-LD: {e}")
     return None
 
+def extract_json_ld_image(soup: BeautifulSoup) -> Optional[str]:
+    """HTML内のJSON-LDスクリプトから画像URLを抽出"""
+    scripts = soup.find_all('script', type='application/ld+json')
+    return _find_image_in_json_ld_texts(script.string for script in scripts)
+
+@functools.lru_cache(maxsize=1024)
+def get_domain(url: str) -> str:
+    """URLのドメイン (小文字のnetloc) を取得 (同一URLの再解析を避けるためキャッシュ)"""
+    return urlparse(url).netloc.lower()
+
+@functools.lru_cache(maxsize=1024)
+def requires_selenium(domain: str) -> bool:
+    """SELENIUM_ONLY_DOMAINS に該当し、最初からSeleniumを使うべきドメインか判定"""
+    return any(d in domain for d in SELENIUM_ONLY_DOMAINS if d) # 空文字を除外
+
+@functools.lru_cache(maxsize=1024)
+def has_site_specific_parser(domain: str) -> bool:
+    """サイト固有の解析ロジックを持つドメインか判定"""
+    return any(d in domain for d in SITE_SPECIFIC_DOMAINS)
+
 def convert_to_absolute_path(base_url: str, target_path: str) -> str:
     """相対パスを絶対パスに変換"""
-    if not target_path or target_path.startswith(('http://', 'https://', 'data:')):
+    if not target_path or target_path.startswith(ABSOLUTE_URL_PREFIXES):
         return target_path or ""
     if target_path.startswith('//'):
         scheme = urlparse(base_url).scheme
@@ -188,75 +609,144 @@ def convert_to_absolute_path(base_url: str, target_path: str) -> str:
 # ============================================
 # 3. 画像処理 (共通基盤)
 # ============================================
-def download_and_prepare_image(image_url: str, target_width: int, referrer_url: Optional[str] = None) -> Optional[Tuple[BytesIO, int, int]]:
-    """画像をダウンロードし、リサイズしてBytesIOオブジェクトで返す"""
+def resize_image_bytes(raw_bytes: bytes, target_width: int, image_url: str = "") -> Optional[Tuple[bytes, int, int]]:
+    """
+    画像のバイト列をデコードして指定幅にリサイズし、(画像バイト列, 幅, 高さ) を返す。
+    プロセスプールから呼べるよう、引数・戻り値はすべてpickle可能な型にしている。
+    PILの例外はそのまま呼び出し元へ送出する。
+    """
+    t_proc_start = time.time()
+    with PILImage.open(BytesIO(raw_bytes)) as img:
+        source_format = img.format
+        original_width, original_height = img.size
+        if original_width <= 0 or original_height <= 0:
+            logging.warning(f"Invalid image dimensions ({original_width}x{original_height}) for URL: {image_url}")
+            return None
+
+        # リサイズ計算
+        aspect_ratio = original_height / original_width
+        target_height = max(1, int(target_width * aspect_ratio))
+
+        # 既に目標幅程度の JPEG/PNG はデコード・再エンコードせず元のバイト列を使う
+        if (source_format in PASSTHROUGH_FORMATS and img.mode in PASSTHROUGH_MODES
+                and original_width <= target_width * PASSTHROUGH_WIDTH_TOLERANCE):
+            logging.debug(f"Image is already {original_width}x{original_height} ({source_format}). Skipping re-encode.")
+            return raw_bytes, target_width, target_height
+
+        # JPEGはlibjpegのDCT領域縮小で必要最小限の解像度のみデコードする
+        # (最終的なLANCZOSの品質を保つため、目標サイズの DRAFT_OVERSAMPLE 倍以上は残す)
+        if source_format == 'JPEG':
+            img.draft('RGB', (target_width * DRAFT_OVERSAMPLE, target_height * DRAFT_OVERSAMPLE))
+            logging.debug(f"JPEG draft mode: decoding at {img.size[0]}x{img.size[1]}")
+
+        # 画像モードの変換（必要に応じて）
+        # パレット画像はそのままではLANCZOSで縮小できないため、縮小前に変換する
+        convert_mode = IMAGE_MODE_CONVERSIONS_BEFORE_RESIZE.get(img.mode)
+        if convert_mode: img = img.convert(convert_mode)
+
+        logging.debug(f"Resizing image from {original_width}x{original_height} to {target_width}x{target_height}")
+        # reducing_gap: 整数倍の高速縮小 (reduce) を先に行い、LANCZOS は最後の仕上げにのみ使う
+        # resize() は新しい画像を返すため、元画像のコピーは作らない
+        img_resized = img.resize((target_width, target_height), PILImage.Resampling.LANCZOS,
+                                 reducing_gap=RESIZE_REDUCING_GAP)
+
+        # CMYK / LA は縮小後の小さい画像で変換する (元の解像度での変換コピーを避ける)
+        convert_mode = IMAGE_MODE_CONVERSIONS_AFTER_RESIZE.get(img_resized.mode)
+        if convert_mode: img_resized = img_resized.convert(convert_mode)
+
+        # 出力バッファとフォーマット決定
+        output_buffer = BytesIO()
+        # 元のフォーマットを尊重するが、WebPやGIFなどはPNGに変換 (ExcelはGIFを直接サポートしないことが多い)
+        save_format = source_format if source_format in EMBEDDABLE_FORMATS else 'PNG'
+        # JPEGでRGBAモードの場合はRGBに変換
+        if save_format == 'JPEG' and img_resized.mode in ('RGBA', 'LA', 'P'):
+            logging.debug("Converting RGBA/LA/P image to RGB for JPEG saving.")
+            img_resized = img_resized.convert('RGB')
+
+        # 画像をバッファに保存
+        img_resized.save(output_buffer, format=save_format, quality=85 if save_format == 'JPEG' else None)
+
+    logging.debug(f"Image processing completed in {time.time() - t_proc_start:.3f}s")
+    return output_buffer.getvalue(), target_width, target_height
+
+# 処理済み画像のキャッシュ: (画像URL, 幅) -> (画像バイト列, 幅, 高さ)。ワーカースレッド間で共有するためロックで保護
+_image_cache: "OrderedDict[Tuple[str, int], Tuple[bytes, int, int]]" = OrderedDict()
+_image_cache_lock = threading.Lock()
+
+def download_and_prepare_image(image_url: str, target_width: int, referrer_url: Optional[str] = None,
+                               session: Optional[requests.Session] = None) -> Optional[Tuple[BytesIO, int, int]]:
+    """画像をダウンロードし、リサイズしてBytesIOオブジェクトで返す (同じ画像URLは2回目以降キャッシュから返す)"""
+    cache_key = (image_url, target_width)
+    with _image_cache_lock:
+        cached = _image_cache.get(cache_key)
+        if cached:
+            _image_cache.move_to_end(cache_key)
+    if cached:
+        logging.debug(f"Image cache hit for: {image_url}")
+        data, width, height = cached
+        return BytesIO(data), width, height
+
+    result = _download_and_prepare_image(image_url, target_width, referrer_url, session)
+    if result:
+        buffer, width, height = result
+        with _image_cache_lock:
+            _image_cache[cache_key] = (buffer.getvalue(), width, height)
+            if len(_image_cache) > IMAGE_CACHE_SIZE:
+                _image_cache.popitem(last=False)
+    return result
+
+def _download_and_prepare_image(image_url: str, target_width: int, referrer_url: Optional[str] = None,
+                                session: Optional[requests.Session] = None) -> Optional[Tuple[BytesIO, int, int]]:
+    """画像をダウンロードし、リサイズしてBytesIOオブジェクトで返す (キャッシュなし)"""
     t_dl_start = time.time()
+    http = session or requests
+    img_response: Optional[requests.Response] = None
     try:
         logging.debug(f"Starting image download for: {image_url}")
         img_headers = HEADERS.copy()
+        img_headers['Accept'] = IMAGE_ACCEPT_HEADER
         if referrer_url:
             img_headers['Referer'] = referrer_url
             logging.debug(f"Using Referer: {referrer_url}")
 
-        # stream=True を使用し、大きな画像をメモリに一気に読み込まないようにする
-        img_response = requests.get(image_url, headers=img_headers, stream=True, timeout=15)
+        # stream=True を使用し、ヘッダーを確認するまで本文は読み込まない
+        img_response = http.get(image_url, headers=img_headers, stream=True, timeout=IMAGE_REQUEST_TIMEOUT)
         img_response.raise_for_status()
-        logging.debug(f"Image download completed in {time.time() - t_dl_start:.3f}s. Status: {img_response.status_code}")
+        logging.debug(f"Image response headers received in {time.time() - t_dl_start:.3f}s. Status: {img_response.status_code}")
 
+        # Content-Type / Content-Length で不要な画像は本文を読む前に除外する
         content_type = img_response.headers.get('content-type')
         if not content_type or not content_type.lower().startswith('image/'):
             logging.warning(f"Non-image content type ({content_type}) for URL: {image_url}")
             return None
 
-        # 画像データをBytesIOに読み込む
-        img_data = BytesIO()
-        for chunk in img_response.iter_content(chunk_size=8192):
-            img_data.write(chunk)
-        img_data.seek(0) # ポインタを先頭に戻す
+        content_length = img_response.headers.get('content-length')
+        if content_length and content_length.isdigit():
+            if int(content_length) == 0:
+                logging.warning(f"Empty image data received for URL: {image_url}")
+                return None
+            if int(content_length) > MAX_IMAGE_BYTES:
+                logging.warning(f"Image too large ({content_length} bytes > {MAX_IMAGE_BYTES}) for URL: {image_url}")
+                return None
 
-        if img_data.getbuffer().nbytes == 0:
+        # レスポンスのストリームから一括で読み込み、チャンク単位のコピーを省く
+        # (元のバイト列は再エンコード不要な場合にそのまま埋め込みに使う)
+        img_response.raw.decode_content = True # gzip等の転送エンコーディングを解除
+        raw_bytes = img_response.raw.read(MAX_IMAGE_BYTES + 1)
+        if not raw_bytes:
             logging.warning(f"Empty image data received for URL: {image_url}")
             return None
+        if len(raw_bytes) > MAX_IMAGE_BYTES:
+            logging.warning(f"Image too large (> {MAX_IMAGE_BYTES} bytes) for URL: {image_url}")
+            return None
+        logging.debug(f"Image body ({len(raw_bytes)} bytes) downloaded in {time.time() - t_dl_start:.3f}s")
 
-        t_proc_start = time.time()
-        with PILImage.open(img_data) as img:
-            # 画像モードの変換（必要に応じて）
-            if img.mode == 'P': img = img.convert('RGBA')
-            elif img.mode == 'CMYK': img = img.convert('RGB')
-            elif img.mode == 'LA': img = img.convert('RGBA')
-
-            original_width, original_height = img.size
-            if original_width <= 0 or original_height <= 0:
-                logging.warning(f"Invalid image dimensions ({original_width}x{original_height}) for URL: {image_url}")
-                return None
-
-            # リサイズ計算
-            aspect_ratio = original_height / original_width
-            target_height = max(1, int(target_width * aspect_ratio))
-
-            logging.debug(f"Resizing image from {original_width}x{original_height} to {target_width}x{target_height}")
-            img_resized = img.resize((target_width, target_height), PILImage.Resampling.LANCZOS)
-
-            # 出力バッファとフォーマット決定
-            output_buffer = BytesIO()
-            # 元のフォーマットを尊重するが、WebPやGIFなどはPNGに変換
-            save_format = img.format if img.format and img.format.upper() in ['JPEG', 'PNG', 'BMP', 'TIFF'] else 'PNG'
-            if save_format == 'GIF': save_format = 'PNG' # ExcelはGIFを直接サポートしないことが多い
-            # JPEGでRGBAモードの場合はRGBに変換
-            if save_format == 'JPEG' and img_resized.mode in ['RGBA', 'LA', 'P']:
-                logging.debug("Converting RGBA/LA/P image to RGB for JPEG saving.")
-                img_resized = img_resized.convert('RGB')
-
-            # 画像をバッファに保存
-            img_resized.save(output_buffer, format=save_format, quality=85 if save_format == 'JPEG' else None)
-
-        output_buffer.seek(0)
-        if output_buffer.closed:
-             logging.error(f"BytesIO buffer is closed unexpectedly after saving: {image_url}")
-             return None
-
-        logging.debug(f"Image processing completed in {time.time() - t_proc_start:.3f}s")
-        return output_buffer, target_width, target_height
+        # デコード・リサイズ (CPU処理) は、プロセスプールが有効ならそちらで実行する
+        prepared = run_cpu_task(resize_image_bytes, raw_bytes, target_width, image_url)
+        if not prepared:
+            return None
+        image_bytes, width, height = prepared
+        return BytesIO(image_bytes), width, height
 
     except requests.exceptions.Timeout:
         logging.error(f"Image download timeout for URL: {image_url}")
@@ -270,6 +760,9 @@ def download_and_prepare_image(image_url: str, target_width: int, referrer_url:
     except Exception as e:
         logging.error(f"Unexpected error during image processing for URL {image_url}: {e}", exc_info=True)
         return None
+    finally:
+        if img_response is not None:
+            img_response.close()
 
 # ============================================
 # 4. HTML 解析ロジック (ビジネスロジック + α)
@@ -308,33 +801,42 @@ def _parse_2ndstreet_image(soup: BeautifulSoup) -> Optional[str]:
                 logging.debug("2ndstreet.jp specific: Found img in goodsImages, but it seems to be a thumbnail.")
     return None
 
+def _mercari_image_from_next_data(next_data_text: str) -> Optional[str]:
+    """Mercari の __NEXT_DATA__ (JSON文字列) から先頭の商品画像URLを取り出す"""
+    try:
+        next_data = json_loads(next_data_text)
+        # データ構造は変更される可能性あり
+        if _MERCARI_PHOTO_EXPR is not None:
+            first_photo = _MERCARI_PHOTO_EXPR.search(next_data)
+        else:
+            photos = next_data.get('props', {}).get('pageProps', {}).get('item', {}).get('photos', [])
+            first_photo = photos[0] if photos and isinstance(photos, list) else None
+        if first_photo and isinstance(first_photo, str):
+            logging.info(f"Found image URL in __NEXT_DATA__ (Mercari): {first_photo[:60]}...")
+            # Mercariの場合、クエリパラメータが付いていることが多いが、そのまま利用
+            return first_photo
+    except Exception as e:
+        logging.warning(f"Error processing Mercari __NEXT_DATA__ JSON: {e}")
+    return None
+
 def _parse_mercari_image(soup: BeautifulSoup) -> Optional[str]:
     """Mercari (mercari.com) から画像URLを抽出"""
     # 1. __NEXT_DATA__ から試す (最も確実なことが多い)
     next_data_script = soup.find('script', id='__NEXT_DATA__', type='application/json')
     if next_data_script and next_data_script.string:
-        try:
-            next_data = json.loads(next_data_script.string)
-            # データ構造は変更される可能性あり
-            photos = next_data.get('props', {}).get('pageProps', {}).get('item', {}).get('photos', [])
-            if photos and isinstance(photos, list) and len(photos) > 0 and isinstance(photos[0], str):
-                image_url = photos[0]
-                logging.info(f"Found image URL in __NEXT_DATA__ (Mercari): {image_url[:60]}...")
-                # Mercariの場合、クエリパラメータが付いていることが多いが、そのまま利用
-                return image_url
-        except Exception as e:
-            logging.warning(f"Error processing Mercari __NEXT_DATA__ JSON: {e}")
+        image_url = _mercari_image_from_next_data(next_data_script.string)
+        if image_url:
+            return image_url
 
     # 2. フォールバック: 特徴的なalt属性を持つimgタグ
-    mercari_img_alt = soup.find('img', alt=lambda x: x and 'のサムネイル' in x)
+    mercari_img_alt = soup.find('img', alt=_MERCARI_THUMBNAIL_ALT_RE)
     if mercari_img_alt and mercari_img_alt.get('src') and 'static.mercdn.net' in mercari_img_alt['src']:
         img_src = mercari_img_alt['src']
         logging.info(f'Found specific img by alt (mercari - fallback): {img_src[:60]}...')
         return img_src # クエリパラメータを除去しない方が良い場合もある
 
     # 3. フォールバック: 特徴的なsrcパターンを持つimgタグ
-    mercari_pattern = re.compile(r'https://static\.mercdn\.net/item/detail/orig/photos/[^"\']+?')
-    img_tag_src = soup.find('img', src=mercari_pattern)
+    img_tag_src = soup.find('img', src=_MERCARI_RE)
     if img_tag_src and img_tag_src.get('src'):
         img_src = img_tag_src['src']
         logging.info(f"Found specific img src (mercari pattern - fallback): {img_src[:60]}...")
@@ -344,17 +846,19 @@ def _parse_mercari_image(soup: BeautifulSoup) -> Optional[str]:
 
 def _parse_amazon_image(soup: BeautifulSoup) -> Optional[str]:
     """Amazonから画像URLを抽出"""
-    # プライマリイメージコンテナIDのリスト (優先度順)
-    image_container_ids = ['imgTagWrapperId', 'landingImage', 'ivLargeImage', 'main-image-container']
+    # 候補コンテナを1回の走査でまとめて取得し、優先度順に選ぶ
+    found_containers = {tag.get('id'): tag for tag in soup.find_all(id=AMAZON_IMAGE_CONTAINER_IDS)}
     main_image_container = None
-    for container_id in image_container_ids:
-        main_image_container = soup.find(id=container_id)
+    container_id = None
+    for container_id in AMAZON_IMAGE_CONTAINER_IDS:
+        main_image_container = found_containers.get(container_id)
         if main_image_container:
             logging.debug(f"Amazon specific: Found container with id '{container_id}'")
             break
 
     if main_image_container:
-        main_img = main_image_container.find('img')
+        # landingImage 等は<img>自体にIDが付いているため、その場合は要素自身を使う
+        main_img = main_image_container if main_image_container.name == 'img' else main_image_container.find('img')
         if main_img:
             potential_src = main_img.get('src') or main_img.get('data-src') # data-srcも考慮
             if potential_src and not potential_src.startswith("data:image") and "captcha" not in potential_src.lower():
@@ -362,7 +866,7 @@ def _parse_amazon_image(soup: BeautifulSoup) -> Optional[str]:
                 # Amazonの画像URLは複雑なことが多く、?以降を除去すると表示されない場合もあるので注意
                 # 一旦そのまま返すか、パターンを見て除去するか判断
                 # 例: ._AC_SL1500_.jpg のようなサイズ指定部分を除去する試み
-                cleaned_url = re.sub(r'\._[A-Z]{2}_\w+_\.', '.', potential_src)
+                cleaned_url = _AMAZON_SIZE_SUFFIX_RE.sub('.', potential_src)
                 if cleaned_url != potential_src:
                      logging.debug(f"Cleaned Amazon URL: {cleaned_url[:60]}...")
                      return cleaned_url
@@ -375,51 +879,26 @@ def _parse_amazon_image(soup: BeautifulSoup) -> Optional[str]:
     return None
 
 # --- 標準的な解析関数 ---
-def _extract_standard_metadata_image(soup: BeautifulSoup, domain: str) -> Optional[str]:
-    """og:image, twitter:image から画像URLを抽出"""
-    image_url = extract_meta_property(soup, 'og:image')
-    # 買取王国の場合、og:imageがロゴ画像のことがあるため除外
-    if image_url and "og_logo.png" in image_url and "okoku.jp" in domain:
-        logging.debug(f"Skipping og:image because it seems to be a logo (okoku.jp): {image_url}")
-        image_url = None
-    elif image_url:
-        logging.info(f"Found og:image: {image_url[:60]}...")
-        return image_url
-
-    image_url = extract_meta_name(soup, 'twitter:image')
-    if image_url:
-        logging.info(f"Found twitter:image: {image_url[:60]}...")
-        return image_url
-
-    return None
-
-def _extract_fallback_image(soup: BeautifulSoup) -> Optional[str]:
-    """最終手段として、一般的なimgタグから画像を探す"""
+def _select_fallback_image(img_attrs_list: Iterable[Mapping[str, Any]]) -> Optional[str]:
+    """imgタグの属性群を評価し、最適な画像URLを選択する (パーサー非依存)"""
     logging.debug("Applying generic img tag fallback logic.")
+    # <img> ごとのデバッグログは、DEBUGが無効なら f-string の組み立てごと省く
+    debug_enabled = logging.getLogger().isEnabledFor(logging.DEBUG)
     checked_sources = set()
-    exclude_patterns = [
-        ".gif", ".svg", "ads", "icon", "logo", "sprite", "avatar", "spinner",
-        "loading", "pixel", "fls-fe.amazon", "transparent", "spacer", "dummy",
-        "captcha", "_tn.", "_mn.", "_thumb.", "/thumb", "-small.", ".small",
-        "nav_", "banner", "profile", "badge", "button", "rating"
-    ]
-    exclude_extensions = ['.php', '.aspx', '.jsp'] # スクリプトを示す拡張子は除外
-
     candidate_images = []
 
-    for img in soup.find_all('img'):
+    for img in img_attrs_list:
         potential_src = img.get('src') or img.get('data-src') # 遅延読み込みも考慮
         if not potential_src or potential_src in checked_sources:
             continue
 
         checked_sources.add(potential_src)
-        src_lower = potential_src.lower()
 
         # 明らかな除外対象かチェック
-        if (src_lower.startswith("data:image") or
-                any(pat in src_lower for pat in exclude_patterns) or
-                any(src_lower.endswith(ext) for ext in exclude_extensions) or
-                len(potential_src) < 15): # 短すぎるURLは除外
+        if (len(potential_src) < 15 or # 短すぎるURLは除外
+                potential_src[:10].lower().startswith("data:image") or
+                _EXCLUDE_RE.search(potential_src) or
+                _EXCLUDE_EXT_RE.search(potential_src)):
             continue
 
         # サイズ情報を取得できれば評価に加える
@@ -435,12 +914,13 @@ def _extract_fallback_image(soup: BeautifulSoup) -> Optional[str]:
             pass # サイズ取得失敗は無視
 
         # alt属性もヒントにする (商品名などが入っている可能性)
-        alt_text = img.get('alt', '').lower()
+        alt_text = (img.get('alt') or '').lower()
         alt_score = 1 if alt_text and 'thumbnail' not in alt_text and 'logo' not in alt_text else 0
 
         # 候補リストに追加 (URL, サイズスコア, altスコア)
         candidate_images.append((potential_src, size_score, alt_score))
-        logging.debug(f"Fallback candidate: {potential_src[:60]}... (Size: {size_score}, Alt: {alt_score})")
+        if debug_enabled:
+            logging.debug(f"Fallback candidate: {potential_src[:60]}... (Size: {size_score}, Alt: {alt_score})")
 
     if not candidate_images:
         logging.debug("No suitable fallback image candidates found.")
@@ -455,24 +935,168 @@ def _extract_fallback_image(soup: BeautifulSoup) -> Optional[str]:
     return best_image_url.split("?")[0]
 
 
+# --- 高速解析 (selectolax / lxml XPath) ---
+# 各バックエンドは (メタ画像の辞書, JSON-LD文字列の遅延イテラブル, img属性の遅延イテラブル) を返す
+FastCandidates = Tuple[Dict[str, str], Iterable[Optional[str]], Iterable[Mapping[str, Any]]]
+
+def _iter_lazily(query: Any, *args: Any) -> Iterable[Any]:
+    """クエリを最初に要素が要求された時点で実行する (前段で画像が見つかれば走査自体を省く)"""
+    yield from query(*args)
+
+def _lexbor_candidates(html_content: str) -> FastCandidates:
+    """selectolax (Lexbor) で画像候補を抽出"""
+    tree = LexborHTMLParser(html_content)
+    meta_images: Dict[str, str] = {}
+    for key, selector in (('og:image', 'meta[property="og:image"]'), ('twitter:image', 'meta[name="twitter:image"]')):
+        node = tree.css_first(selector)
+        if node and node.attributes.get('content'):
+            meta_images[key] = node.attributes['content']
+    ld_json_texts = (node.text(deep=True) for node in _iter_lazily(tree.css, 'script[type="application/ld+json"]'))
+    img_attrs = (node.attributes for node in _iter_lazily(tree.css, 'img'))
+    return meta_images, ld_json_texts, img_attrs
+
+def _lxml_candidates(html_content: str) -> FastCandidates:
+    """lxml のコンパイル済みXPathで画像候補を抽出 (libxml2 の1回の走査でメタタグをまとめて取得)"""
+    root = lxml_html.fromstring(html_content)
+    # 各キーは最初のタグだけを見る (content が空でも次の同名タグには進まない: Lexbor の css_first と同じ優先順)
+    first_contents: Dict[str, Optional[str]] = {}
+    for meta in _META_IMAGE_XP(root):
+        key = meta.get('property') if meta.get('property') == 'og:image' else 'twitter:image'
+        first_contents.setdefault(key, meta.get('content'))
+    meta_images = {key: content for key, content in first_contents.items() if content}
+    ld_json_texts = _iter_lazily(_LD_JSON_XP, root)
+    img_attrs = (img.attrib for img in _iter_lazily(_IMG_XP, root))
+    return meta_images, ld_json_texts, img_attrs
+
+def _soup_candidates(soup: BeautifulSoup) -> FastCandidates:
+    """BeautifulSoup のツリーを1回だけ走査し、meta / JSON-LD / img を振り分けて画像候補を集める"""
+    first_contents: Dict[str, Optional[str]] = {} # 各キーの最初のタグの content (空でも次の同名タグには進まない)
+    ld_json_texts: List[Optional[str]] = []
+    img_attrs: List[Mapping[str, Any]] = []
+    for tag in soup.find_all(['meta', 'script', 'img']):
+        if tag.name == 'img':
+            img_attrs.append(tag.attrs)
+        elif tag.name == 'script':
+            if tag.get('type') == 'application/ld+json':
+                ld_json_texts.append(tag.string)
+        elif tag.get('property') == 'og:image':
+            first_contents.setdefault('og:image', tag.get('content'))
+        elif tag.get('name') == 'twitter:image':
+            first_contents.setdefault('twitter:image', tag.get('content'))
+    meta_images = {key: content for key, content in first_contents.items() if content}
+    return meta_images, ld_json_texts, img_attrs
+
+def _select_image_from_candidates(candidates: FastCandidates, domain: str) -> Tuple[Optional[str], bool]:
+    """
+    画像候補から メタタグ → JSON-LD → フォールバック<img> の優先順で画像URLを選ぶ (パーサー非依存)。
+    Returns:
+        Tuple[Optional[str], bool]: (画像URL, STATIC_IMAGE_MARKERS のメタタグに空でない content があったか)
+    """
+    meta_images, ld_json_texts, img_attrs = candidates
+    has_static_image = any(meta_images.get(key) for key in STATIC_IMAGE_MARKERS)
+
+    # 1. 標準的なメタデータ (og:image, twitter:image)
+    image_url = meta_images.get('og:image')
+    # 買取王国の場合、og:imageがロゴ画像のことがあるため除外
+    if image_url and "og_logo.png" in image_url and "okoku.jp" in domain:
+        logging.debug(f"Skipping og:image because it seems to be a logo (okoku.jp): {image_url}")
+    elif image_url:
+        logging.info(f"Found og:image: {image_url[:60]}...")
+        return image_url, has_static_image
+
+    image_url = meta_images.get('twitter:image')
+    if image_url:
+        logging.info(f"Found twitter:image: {image_url[:60]}...")
+        return image_url, has_static_image
+
+    # 2. JSON-LD
+    image_url = _find_image_in_json_ld_texts(ld_json_texts)
+    if image_url:
+        return image_url, has_static_image
+
+    # 3. フォールバック (一般的な<img>タグ)
+    return _select_fallback_image(img_attrs), has_static_image
+
+def parse_html_for_image_fast(html_content: str, base_url: str, domain: Optional[str] = None) -> Tuple[Optional[str], bool]:
+    """
+    selectolax (Lexbor)、なければ lxml のXPathを使い、メタタグ → JSON-LD → フォールバック<img> の順で画像URLを探す。
+    サイト固有ロジックは扱わない。(絶対パス変換前のURL, 静的なメタ画像があったか) を返す。
+    どちらも利用できない場合やパースに失敗した場合は例外を送出する。
+    """
+    t_start = time.time()
+    if LexborHTMLParser is not None:
+        backend = "LexborHTMLParser"
+        meta_images, ld_json_texts, img_attrs = _lexbor_candidates(html_content)
+    elif lxml_html is not None:
+        backend = "lxml XPath"
+        meta_images, ld_json_texts, img_attrs = _lxml_candidates(html_content)
+    else:
+        raise ImportError("Neither selectolax nor lxml is installed")
+    logging.debug(f"{backend} parsed in {time.time() - t_start:.3f}s")
+    return _select_image_from_candidates((meta_images, ld_json_texts, img_attrs), domain or get_domain(base_url))
+
 # --- HTML解析メイン関数 ---
-def parse_html_for_image(html_content: str, base_url: str) -> Optional[str]:
-    """HTMLコンテンツを解析して最適な画像URLを返す"""
+def _make_soup(html_content: str, parse_only: Optional[SoupStrainer] = None) -> BeautifulSoup:
+    """
+    lxmlパーサーでBeautifulSoupを生成 (失敗時は html.parser にフォールバック)。
+    parse_only を指定すると、一致するタグ以外のノードを生成しない。
+    """
+    try:
+        return BeautifulSoup(html_content, HTML_PARSER, parse_only=parse_only)
+    except FeatureNotFound:
+        logging.debug(f"Parser '{HTML_PARSER}' is not installed. Falling back to '{FALLBACK_HTML_PARSER}'.")
+    except Exception as e:
+        logging.warning(f"Parser '{HTML_PARSER}' failed ({e}). Falling back to '{FALLBACK_HTML_PARSER}'.")
+    return BeautifulSoup(html_content, FALLBACK_HTML_PARSER, parse_only=parse_only)
+
+def _soup_strainer_for(domain: str) -> Optional[SoupStrainer]:
+    """ドメインに応じたSoupStrainerを返す (コンテナ要素を辿るサイト固有ロジックがある場合は全体を解析)"""
+    if any(d in domain for d in FULL_DOM_DOMAINS):
+        return None
+    return IMAGE_TAGS_STRAINER
+
+def parse_html_for_image(html_content: str, base_url: str, domain: Optional[str] = None) -> Optional[str]:
+    """HTMLコンテンツを解析して最適な画像URLを返す (domain は呼び出し元で解析済みなら渡す)"""
+    return parse_html_for_image_with_static_flag(html_content, base_url, domain)[0]
+
+def parse_html_for_image_with_static_flag(html_content: str, base_url: str,
+                                          domain: Optional[str] = None) -> Tuple[Optional[str], bool]:
+    """
+    parse_html_for_image と同じ解析を行い、(画像URL, 静的なメタ画像があったか) を返す。
+    2つ目の値はSeleniumでの再試行を省くかの判定に使う (サイト固有ロジックを持つドメインでは常に False)。
+    """
     if not html_content:
         logging.warning("parse_html_for_image received empty HTML content.")
-        return None
+        return None, False
 
     t_start = time.time()
     logging.debug(f"Start parsing HTML for: {base_url}")
+    domain = domain or get_domain(base_url)
+
+    # サイト固有ロジックが不要なドメインは selectolax / lxml の高速パスで解析
+    if (LexborHTMLParser is not None or lxml_html is not None) and not has_site_specific_parser(domain):
+        try:
+            image_url, has_static_image = parse_html_for_image_fast(html_content, base_url, domain)
+            return _finalize_image_url(base_url, image_url, t_start), has_static_image
+        except Exception as e:
+            logging.warning(f"Fast parsing failed for {base_url}: {e}. Falling back to BeautifulSoup.")
+
+    # Mercari は __NEXT_DATA__ をHTMLから正規表現で直接取り出せれば、ツリーを構築せずに済む
+    if "mercari.com" in domain:
+        match = _NEXT_DATA_RE.search(html_content)
+        image_url = _mercari_image_from_next_data(match.group(1)) if match else None
+        if image_url:
+            return _finalize_image_url(base_url, image_url, t_start), False
+
     try:
-        soup = BeautifulSoup(html_content, 'html.parser')
+        soup = _make_soup(html_content, _soup_strainer_for(domain))
     except Exception as e:
         logging.error(f"BeautifulSoup parsing failed for {base_url}: {e}", exc_info=True)
-        return None
+        return None, False
     logging.debug(f"BeautifulSoup parsed in {time.time() - t_start:.3f}s")
 
-    domain = urlparse(base_url).netloc.lower()
     image_url: Optional[str] = None
+    has_static_image = False
 
     # 1. サイト固有のロジック (優先度 高)
     logging.debug(f"Checking site-specific parsers for domain: {domain}")
@@ -483,22 +1107,16 @@ def parse_html_for_image(html_content: str, base_url: str) -> Optional[str]:
     # 他のサイト固有ロジックがあればここに追加
     # elif "example.com" in domain: image_url = _parse_example_image(soup)
 
-    # 2. 標準的なメタデータ (og:image, twitter:image)
+    # 2. 標準的なメタデータ → JSON-LD → フォールバック<img> (ツリーは1回だけ走査する)
     if not image_url:
-        logging.debug("Trying standard metadata (og:image, twitter:image)")
-        image_url = _extract_standard_metadata_image(soup, domain)
+        logging.debug("Trying standard metadata, JSON-LD and fallback <img> tags")
+        image_url, has_static_image = _select_image_from_candidates(_soup_candidates(soup), domain)
+        has_static_image = has_static_image and not has_site_specific_parser(domain)
 
-    # 3. JSON-LD
-    if not image_url:
-        logging.debug("Trying JSON-LD extraction")
-        image_url = extract_json_ld_image(soup)
-
-    # 4. フォールバック (一般的な<img>タグ)
-    if not image_url:
-        logging.debug("Trying fallback image extraction from <img> tags")
-        image_url = _extract_fallback_image(soup)
+    return _finalize_image_url(base_url, image_url, t_start), has_static_image
 
-    # 最終的なURLの絶対パス変換と返却
+def _finalize_image_url(base_url: str, image_url: Optional[str], t_start: float) -> Optional[str]:
+    """最終的なURLの絶対パス変換と返却"""
     if image_url:
         final_url = convert_to_absolute_path(base_url, image_url)
         logging.info(f"Found image URL: {final_url}")
@@ -512,8 +1130,80 @@ def parse_html_for_image(html_content: str, base_url: str) -> Optional[str]:
 # ============================================
 # 5. コア Web スクレイピング処理
 # ============================================
-def _get_image_url_with_selenium(driver: webdriver.Chrome, url: str) -> Optional[str]:
-    """指定されたURLをSeleniumで開き、画像URLを抽出する"""
+def _wait_for_image_elements(driver: webdriver.Chrome, url: str):
+    """画像URLの抽出に必要な要素が現れるまで待機する (タイムアウトしてもそのまま続行)"""
+    domain = get_domain(url)
+    # サイト固有の要素がある場合はそれだけを待つ (メタタグが先に現れても画像要素の描画前に打ち切らない。
+    # また、メタタグのないページで汎用セレクタのタイムアウトを待ってから画像要素を待つこともない)
+    selector = next((sel for d, sel in SELENIUM_SITE_READY_SELECTORS.items() if d in domain), SELENIUM_READY_SELECTOR)
+
+    t_wait = time.time()
+    try:
+        WebDriverWait(driver, SELENIUM_WAIT_TIMEOUT).until(EC.presence_of_element_located((By.CSS_SELECTOR, selector)))
+    except TimeoutException:
+        logging.debug(f"Element '{selector}' did not appear within {SELENIUM_WAIT_TIMEOUT}s. Continuing.")
+    logging.debug(f"Selenium wait completed in {time.time() - t_wait:.3f}s")
+
+# Seleniumでの抽出結果のキャッシュ (URL -> 画像URL。見つかった場合のみ)。同じURLの行でページを再読み込みしない
+_selenium_result_cache: Dict[str, str] = {}
+_selenium_result_cache_lock = threading.Lock()
+
+# 実行中に学習した「requestsでは取れずSeleniumで取れた」回数 (ドメイン -> 回数)
+_selenium_preferred_domains: Dict[str, int] = {}
+_selenium_preferred_domains_lock = threading.Lock()
+
+def prefers_selenium(domain: str) -> bool:
+    """この実行中、requests を試さず最初からSeleniumを使うべきと学習したドメインか判定"""
+    with _selenium_preferred_domains_lock:
+        return _selenium_preferred_domains.get(domain, 0) >= SELENIUM_LEARN_THRESHOLD
+
+def record_selenium_outcome(domain: str, selenium_needed: bool) -> None:
+    """ドメインごとの取得結果を記録する (requestsで取れた、または学習後にSeleniumでも取れなかった場合はリセット)"""
+    with _selenium_preferred_domains_lock:
+        if selenium_needed:
+            _selenium_preferred_domains[domain] = _selenium_preferred_domains.get(domain, 0) + 1
+        else:
+            _selenium_preferred_domains.pop(domain, None)
+
+def _get_image_url_with_selenium(driver_manager: WebDriverManager, url: str) -> Optional[str]:
+    """指定されたURLをSeleniumで開き、画像URLを抽出する (WebDriverはプールから借りる。結果はURLごとにキャッシュ)"""
+    with _selenium_result_cache_lock:
+        if url in _selenium_result_cache:
+            logging.info(f"Using cached Selenium result for {url}")
+            return _selenium_result_cache[url]
+
+    driver = driver_manager.acquire_driver() # 必要になった時点でChromeを起動
+    if not driver:
+        return None
+    image_url = None
+    try:
+        image_url = _get_image_url_with_driver(driver, url)
+    except WebDriverException as e:
+        # Chromeのクラッシュ等でセッションが失われた場合は、起動し直して1回だけ再試行する
+        logging.warning(f"WebDriver session lost ({type(e).__name__}). Restarting WebDriver for {url}")
+        driver = driver_manager.restart_driver(driver)
+        if driver:
+            try:
+                image_url = _get_image_url_with_driver(driver, url)
+            except WebDriverException as retry_error:
+                logging.error(f"WebDriver session lost again for URL {url}: {retry_error}")
+    finally:
+        if driver:
+            driver_manager.release_driver(driver)
+
+    if image_url: # タイムアウトやWebDriverのエラーは一時的な可能性があるため成功のみ保存
+        with _selenium_result_cache_lock:
+            if len(_selenium_result_cache) >= SELENIUM_CACHE_SIZE:
+                _selenium_result_cache.pop(next(iter(_selenium_result_cache)))
+            _selenium_result_cache[url] = image_url
+    return image_url
+
+def _is_session_lost(error: WebDriverException) -> bool:
+    """WebDriverのセッション自体が失われたエラーか (ページ単位のエラーとは区別する)"""
+    return isinstance(error, InvalidSessionIdException) or "disconnected" in str(error).lower()
+
+def _get_image_url_with_driver(driver: webdriver.Chrome, url: str) -> Optional[str]:
+    """貸し出されたWebDriverでSeleniumによる画像URL抽出を行う"""
     image_url = None
     try:
         logging.info(f"Attempting to fetch URL with Selenium: {url}")
@@ -523,12 +1213,8 @@ def _get_image_url_with_selenium(driver: webdriver.Chrome, url: str) -> Optional
         driver.get(url)
         logging.debug(f"Selenium driver.get() completed in {time.time() - t_get:.3f}s")
 
-        # JavaScriptの実行や動的コンテンツの読み込みを待機 (必要に応じて調整)
-        # time.sleep(2) # 固定待機 (あまり推奨されない)
-        # WebDriverWait(driver, 10).until(...) # 特定の要素が現れるまで待機 (より堅牢)
-        # ここでは短い固定待機を入れておく
-        t_sleep = time.time(); wait_seconds = 0.5; logging.debug(f"Waiting {wait_seconds}s for dynamic content...")
-        time.sleep(wait_seconds); logging.debug(f"Selenium wait completed in {time.time() - t_sleep:.3f}s")
+        # JavaScriptの実行や動的コンテンツの読み込みを、画像情報を含む要素が現れるまで待機
+        _wait_for_image_elements(driver, url)
 
         t_source = time.time()
         page_source = driver.page_source
@@ -537,7 +1223,7 @@ def _get_image_url_with_selenium(driver: webdriver.Chrome, url: str) -> Optional
         logging.info(f"Successfully fetched page source with Selenium (Final URL: {current_url})")
 
         # 取得したHTMLソースを解析
-        image_url = parse_html_for_image(page_source, current_url)
+        image_url = run_cpu_task(parse_html_for_image, page_source, current_url)
 
         if image_url:
             logging.info(f"Found image URL using Selenium for {url}")
@@ -547,6 +1233,8 @@ def _get_image_url_with_selenium(driver: webdriver.Chrome, url: str) -> Optional
     except TimeoutException:
         logging.error(f"Selenium page load timed out ({SELENIUM_TIMEOUT}s) for URL: {url}")
     except WebDriverException as e:
+        if _is_session_lost(e):
+            raise # 呼び出し元でWebDriverを再起動する
         logging.error(f"Selenium WebDriver error for URL {url}: {e}", exc_info=True)
         # ここで特定のWebDriverエラーに対するハンドリングを追加可能
         # 例: if "net::ERR_CONNECTION_REFUSED" in str(e): ...
@@ -555,30 +1243,68 @@ def _get_image_url_with_selenium(driver: webdriver.Chrome, url: str) -> Optional
 
     return image_url
 
-def get_image_url_from_url(url: str, driver: Optional[webdriver.Chrome] = None) -> Tuple[Optional[str], Optional[str]]:
+def detect_html_encoding(response: requests.Response) -> str:
+    """レスポンスの文字コードを Content-Type ヘッダー、<meta charset>、UTF-8 の順で決定する"""
+    if 'charset' in response.headers.get('content-type', '').lower() and response.encoding:
+        return response.encoding
+    match = _META_CHARSET_RE.search(response.content[:META_CHARSET_SCAN_BYTES])
+    if match:
+        encoding = match.group(1).decode('ascii', 'ignore')
+        try:
+            codecs.lookup(encoding)
+            return encoding
+        except LookupError:
+            logging.debug(f"Unknown charset in <meta>: {encoding}")
+    return 'utf-8'
+
+def get_image_url_from_url(url: str, driver_manager: Optional[WebDriverManager] = None,
+                           session: Optional[requests.Session] = None,
+                           rate_limiter: Optional[HostRateLimiter] = None) -> Tuple[Optional[str], Optional[str]]:
     """
     指定されたURLから画像URLを取得するメイン関数。
     まずrequestsで試行し、失敗した場合や特定のドメインの場合はSeleniumを使用する。
+    session を渡すとコネクションを再利用する。
+    解析結果キャッシュが有効な場合、以前の実行で画像URLが見つかったURLはアクセスせずに結果を返す。
+    rate_limiter を渡すと、キャッシュになくページにアクセスする場合に限り同一ホストへのアクセス間隔を空ける。
     Returns:
         Tuple[Optional[str], Optional[str]]: (画像URL, エラーメッセージ)
     """
+    cached_image_url = result_cache_get(url)
+    if cached_image_url:
+        logging.info(f"Using cached image URL for {url}: {cached_image_url}")
+        return cached_image_url, None
+
+    if rate_limiter:
+        rate_limiter.wait(get_domain(url))
+
+    image_url, error_message = _fetch_image_url_from_url(url, driver_manager, session)
+    if image_url:
+        result_cache_set(url, image_url) # 失敗は一時的な可能性があるため成功のみ保存
+    return image_url, error_message
+
+def _fetch_image_url_from_url(url: str, driver_manager: Optional[WebDriverManager] = None,
+                              session: Optional[requests.Session] = None) -> Tuple[Optional[str], Optional[str]]:
+    """get_image_url_from_url の本体 (キャッシュなし)"""
     final_image_url: Optional[str] = None
     error_message: Optional[str] = None
     t_start_url = time.time()
 
-    parsed_url = urlparse(url)
-    domain = parsed_url.netloc.lower()
+    domain = get_domain(url)
 
     # --- Seleniumを直接使用するかどうかの判定 ---
-    # SELENIUM_ONLY_DOMAINS に含まれるドメインは、最初からSeleniumを使う
-    use_selenium_directly = any(d in domain for d in SELENIUM_ONLY_DOMAINS if d) # 空文字を除外
+    # SELENIUM_ONLY_DOMAINS に含まれるドメインと、この実行中にSeleniumが必要と学習したドメインは、最初からSeleniumを使う
+    learned_selenium = (not requires_selenium(domain) and driver_manager is not None
+                        and driver_manager.is_available() and prefers_selenium(domain))
+    use_selenium_directly = requires_selenium(domain) or learned_selenium
 
     if use_selenium_directly:
-        logging.info(f"Domain '{domain}' requires Selenium. Using Selenium directly for {url}")
-        if driver:
-            final_image_url = _get_image_url_with_selenium(driver, url)
+        logging.info(f"Domain '{domain}' {'was learned to need' if learned_selenium else 'requires'} Selenium. Using Selenium directly for {url}")
+        if driver_manager and driver_manager.is_available():
+            final_image_url = _get_image_url_with_selenium(driver_manager, url)
+            if learned_selenium and not final_image_url:
+                record_selenium_outcome(domain, selenium_needed=False) # 次の行からは再び requests を先に試す
             if not final_image_url:
-                error_message = "画像が見つかりません(Sel-Direct)"
+                error_message = "画像が見つかりません(Sel-Direct)" if driver_manager.is_available() else "画像が見つかりません(NoDriver)"
         else:
             logging.warning(f"Selenium is required for {url}, but Selenium driver is not available.")
             error_message = "画像が見つかりません(NoDriver)"
@@ -592,26 +1318,36 @@ def get_image_url_from_url(url: str, driver: Optional[webdriver.Chrome] = None)
     response: Optional[requests.Response] = None
     html_content: str = ""
     base_url: str = url
+    skip_selenium_retry = False
 
     try:
-        response = requests.get(url, headers=HEADERS, timeout=REQUEST_TIMEOUT, allow_redirects=True)
+        http = session or requests
+        response = http.get(url, headers=HEADERS, timeout=REQUEST_TIMEOUT, allow_redirects=True)
         logging.debug(f"requests.get() completed in {time.time() - t_req_start:.3f}s")
 
         # ステータスコードチェック
         response.raise_for_status()
 
         # エンコーディング設定 (文字化け対策)
-        response.encoding = response.apparent_encoding
+        # chardet による本文全体の推測 (apparent_encoding) は遅いため、ヘッダー → <meta charset> → UTF-8 の順で決定
+        response.encoding = detect_html_encoding(response)
         html_content = response.text
         base_url = response.url # リダイレクト後のURLを使用
         logging.info(f"Requests success for {url} (Final: {base_url}) - Status: {response.status_code}")
 
         # HTML解析
-        final_image_url = parse_html_for_image(html_content, base_url)
+        # リダイレクトされていなければ解析済みのドメインを渡す
+        final_image_url, has_static_image = run_cpu_task(parse_html_for_image_with_static_flag, html_content, base_url,
+                                                         domain if base_url == url else None)
 
-        if not final_image_url:
+        if final_image_url:
+            record_selenium_outcome(domain, selenium_needed=False)
+        else:
             error_message = "画像が見つかりません(Req)"
             logging.warning(f"Image not found with requests for: {url}")
+            # 画像情報がHTMLに静的に含まれているなら、Seleniumで取得し直しても同じ結果になる
+            # (サイト固有ロジックは静的HTMLの値を除外することがあるため、その場合は再試行する)
+            skip_selenium_retry = has_static_image
 
     except requests.exceptions.Timeout:
         error_message = f"タイムアウト(>{REQUEST_TIMEOUT}s)(Req)"
@@ -632,21 +1368,24 @@ def get_image_url_from_url(url: str, driver: Optional[webdriver.Chrome] = None)
     # --- Seleniumでのリトライ ---
     # requestsで画像が見つからなかった、またはrequests自体が失敗した場合で、
     # かつSeleniumドライバが利用可能な場合にリトライする
-    if not final_image_url and driver:
+    if not final_image_url and skip_selenium_retry:
+        logging.info(f"Static og:image/twitter:image is present in the HTML of {url}. Skipping Selenium retry.")
+    elif not final_image_url and driver_manager and driver_manager.is_available():
         logging.info(f"Requests failed or couldn't find image for {url}. Retrying with Selenium...")
         t_sel_start = time.time()
-        selenium_image_url = _get_image_url_with_selenium(driver, url)
+        selenium_image_url = _get_image_url_with_selenium(driver_manager, url)
         logging.debug(f"_get_image_url_with_selenium (Retry) completed in {time.time() - t_sel_start:.3f}s")
 
         if selenium_image_url:
             final_image_url = selenium_image_url
             error_message = None # Seleniumで成功したのでエラーメッセージをクリア
+            record_selenium_outcome(domain, selenium_needed=True)
         else:
             # Seleniumでも見つからなかった場合、エラーメッセージを更新または追記
             current_error = error_message if error_message else "取得エラー"
             error_message = f"{current_error} / 画像が見つかりません(Sel-Retry)"
 
-    elif not final_image_url and not driver:
+    elif not final_image_url:
         logging.warning(f"Requests failed for {url}, and Selenium retry is unavailable (no driver).")
         if not error_message: # requestsは成功したが画像が見つからなかった場合
              error_message = "画像が見つかりません(Req, No Retry)"
@@ -659,8 +1398,12 @@ def get_image_url_from_url(url: str, driver: Optional[webdriver.Chrome] = None)
 # ============================================
 # 6. Excel 処理 (ファイル入出力)
 # ============================================
-def load_workbook_and_sheet(file_path: str, sheet_identifier: Any) -> Tuple[Optional[Workbook], Optional[Worksheet]]:
-    """Excelファイルを読み込み、指定されたシートを取得する"""
+def load_workbook_and_sheet(file_path: str, sheet_identifier: Any,
+                            read_only: bool = False) -> Tuple[Optional[Workbook], Optional[Worksheet]]:
+    """
+    Excelファイルを読み込み、指定されたシートを取得する。
+    read_only=True の場合は読み取り専用 (ストリーミング・数式は計算済みの値) で開く。ヘッダーとURL列の走査用。
+    """
     if not os.path.isfile(file_path):
         print(f"エラー: ファイルが見つかりません: '{file_path}'")
         logging.error(f"Input file not found: {file_path}")
@@ -671,10 +1414,14 @@ def load_workbook_and_sheet(file_path: str, sheet_identifier: Any) -> Tuple[Opti
         return None, None
 
     t_excel_load = time.time()
-    print(f"入力ファイル '{file_path}' を読み込んでいます...")
+    if not read_only:
+        print(f"入力ファイル '{file_path}' を読み込んでいます...")
     try:
-        workbook = openpyxl.load_workbook(file_path)
-        logging.info(f"Excel file loaded in {time.time() - t_excel_load:.3f}s")
+        if read_only:
+            workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        else:
+            workbook = openpyxl.load_workbook(file_path)
+        logging.info(f"Excel file loaded{' (read-only)' if read_only else ''} in {time.time() - t_excel_load:.3f}s")
 
         sheet_name: Optional[str] = None
         if isinstance(sheet_identifier, int):
@@ -691,7 +1438,8 @@ def load_workbook_and_sheet(file_path: str, sheet_identifier: Any) -> Tuple[Opti
              raise ValueError(f"無効なシート識別子: {sheet_identifier} (文字列または整数を指定してください)")
 
         sheet = workbook[sheet_name]
-        print(f"処理対象シート: '{sheet.title}'")
+        if read_only:
+            print(f"処理対象シート: '{sheet.title}'")
         return workbook, sheet
     except ValueError as ve:
         print(f"シート選択エラー: {ve}")
@@ -708,9 +1456,11 @@ def get_column_indices(sheet: Worksheet, required_headers: List[str]) -> Optiona
     header_row_index = 1 # ヘッダーは1行目にあると仮定
     headers: Dict[str, int] = {}
     try:
-        for cell in sheet[header_row_index]:
-            if cell.value is not None:
-                headers[str(cell.value)] = cell.column
+        # iter_rows は読み取り専用のシートでも使える。値だけを読み、セルオブジェクト (空セルを含む) は生成しない
+        header_values = next(sheet.iter_rows(min_row=header_row_index, max_row=header_row_index, values_only=True), ())
+        for col_idx, value in enumerate(header_values, start=1):
+            if value is not None:
+                headers[str(value)] = col_idx
         logging.debug(f"Found headers: {headers}")
 
         # 必要なヘッダーが存在するかチェック
@@ -728,26 +1478,45 @@ def get_column_indices(sheet: Worksheet, required_headers: List[str]) -> Optiona
         logging.error(f"Error parsing header row in sheet '{sheet.title}': {e}", exc_info=True)
         return None
 
-def clear_previous_results(sheet: Worksheet, url_col_idx: int, img_url_col_idx: int, img_embed_col_letter: str, hyphen_col_letter: str):
+def read_url_column(sheet_ro: Worksheet, url_col_idx: int) -> Optional[List[Any]]:
+    """
+    読み取り専用で開いたシートから、URL列の値 (2行目以降) だけを取得する。
+    セルオブジェクトを生成しないため、行数の多いシートでも高速・省メモリ。
+    失敗した場合は None を返す (呼び出し側で通常のシート走査にフォールバック)。
+    """
+    t_scan = time.time()
+    try:
+        url_values = [row[0] for row in sheet_ro.iter_rows(min_row=2, min_col=url_col_idx, max_col=url_col_idx, values_only=True)]
+        logging.info(f"Scanned {len(url_values)} URL cells (read-only) in {time.time() - t_scan:.3f}s")
+        return url_values
+    except Exception as e:
+        logging.warning(f"Read-only scan of sheet '{sheet_ro.title}' failed: {e}")
+        return None
+
+def clear_previous_results(sheet: Worksheet, url_col_idx: int, img_url_col_idx: int, img_embed_col_idx: int, hyphen_col_idx: int):
     """指定された列の既存の処理結果をクリアする"""
     logging.info("Clearing previous results (Image URL, Embedded Image, Hyphen)...")
-    img_embed_col_idx = openpyxl.utils.column_index_from_string(img_embed_col_letter)
-    hyphen_col_idx = openpyxl.utils.column_index_from_string(hyphen_col_letter)
 
-    for row_idx in range(2, sheet.max_row + 1): # ヘッダー行(1)を除く
+    # 対象の3列を含む範囲を iter_rows で1回だけ走査し、行タプル内の位置で各セルを取り出す
+    min_col = min(img_url_col_idx, hyphen_col_idx, img_embed_col_idx)
+    max_col = max(img_url_col_idx, hyphen_col_idx, img_embed_col_idx)
+    img_url_offset = img_url_col_idx - min_col
+    hyphen_offset = hyphen_col_idx - min_col
+    img_embed_offset = img_embed_col_idx - min_col
+
+    for row in sheet.iter_rows(min_row=2, max_row=sheet.max_row, min_col=min_col, max_col=max_col): # ヘッダー行(1)を除く
         # 画像URL列
-        img_url_cell = sheet.cell(row=row_idx, column=img_url_col_idx)
+        img_url_cell = row[img_url_offset]
         img_url_cell.value = None
         img_url_cell.hyperlink = None
-        img_url_cell.style = 'Normal' # スタイルをリセット
+        if img_url_cell.has_style:
+            img_url_cell.style = 'Normal' # スタイルをリセット (書式のないセルは既に標準のため名前付きスタイルの検索を省く)
 
         # ハイフン列
-        hyphen_cell = sheet.cell(row=row_idx, column=hyphen_col_idx)
-        hyphen_cell.value = None
+        row[hyphen_offset].value = None
 
         # 画像埋め込み列 (値は通常Noneだが、念のため)
-        img_embed_cell = sheet.cell(row=row_idx, column=img_embed_col_idx)
-        img_embed_cell.value = None # 画像自体は後で削除
+        row[img_embed_offset].value = None # 画像自体は後で削除
 
     # 既存の画像をシートから削除
     if sheet._images:
@@ -757,40 +1526,165 @@ def clear_previous_results(sheet: Worksheet, url_col_idx: int, img_url_col_idx:
     logging.info("Previous results cleared.")
 
 
-def process_excel_rows(
+class RerouteToSelenium(Exception):
+    """実行中にSeleniumが必要と学習したドメインの行を、Selenium専用のスレッドプールで処理し直すための例外"""
+
+def fetch_and_prepare_row(
+    url: str,
+    image_width: int,
+    rate_limiter: Optional[HostRateLimiter],
+    driver_manager: Optional[WebDriverManager],
+    session: Optional[requests.Session] = None,
+    reroute_learned_selenium: bool = False
+) -> Tuple[Optional[str], Optional[str], Optional[Tuple[BytesIO, int, int]]]:
+    """
+    1行分のネットワーク処理 (画像URL取得 + 画像ダウンロード/リサイズ) を行う。
+    ワーカースレッドから呼ばれるため、シートには一切触れない。
+    reroute_learned_selenium=True の場合、Seleniumが必要と学習済みのドメインの行は処理せず RerouteToSelenium を送出する
+    (requests 用のワーカースレッドがWebDriverの空き待ちで塞がるのを防ぐ)。
+    Returns:
+        Tuple: (画像URL, エラーメッセージ, (画像バッファ, 幅, 高さ) または None)
+    """
+    if reroute_learned_selenium and driver_manager and driver_manager.is_available():
+        domain = get_domain(url)
+        if not requires_selenium(domain) and prefers_selenium(domain):
+            raise RerouteToSelenium(url)
+
+    # 同一ホストへのアクセス間隔を空けてサーバー負荷を抑える (別ホストや解析結果キャッシュで済む行は待たない)
+    image_url, error_message = get_image_url_from_url(url, driver_manager, session, rate_limiter)
+    image_result = None
+    if image_url:
+        image_result = download_and_prepare_image(image_url, image_width, referrer_url=url, session=session)
+    return image_url, error_message, image_result
+
+# 埋め込み待ちの画像: (行番号, 画像バッファ, 幅, 高さ)
+PendingEmbed = Tuple[int, BytesIO, int, int]
+
+def write_row_result(
+    sheet: Worksheet,
+    row_index: int,
+    img_url_col_idx: int,
+    img_embed_col_idx: int,
+    image_url: Optional[str],
+    error_message: Optional[str],
+    image_result: Optional[Tuple[BytesIO, int, int]]
+) -> Optional[PendingEmbed]:
+    """
+    1行分の処理結果 (画像URL・エラー) をシートへ書き込む (メインスレッドからのみ呼ぶこと)。
+    画像がある場合は埋め込み待ちの情報を返す。画像の埋め込みと行・列のサイズ調整は embed_images でまとめて行う。
+    """
+    img_url_cell = sheet.cell(row=row_index, column=img_url_col_idx)
+
+    if image_url:
+        img_url_cell.value = image_url
+        # ハイパーリンクを設定（Excelの制限に注意）
+        try:
+             img_url_cell.hyperlink = image_url
+             img_url_cell.style = "Hyperlink"
+        except Exception as e:
+             logging.warning(f"Row {row_index}: Failed to set hyperlink for image URL: {e}")
+
+        if image_result:
+            image_data_buffer, img_width, img_height = image_result
+            return row_index, image_data_buffer, img_width, img_height
+        else:
+            # 画像ダウンロード/処理失敗
+            logging.warning(f"Row {row_index}: Failed to download or prepare image from URL: {image_url}")
+            sheet.cell(row=row_index, column=img_embed_col_idx).value = "画像DL/処理失敗"
+    else:
+        # 画像URL取得失敗
+        img_url_cell.value = error_message if error_message else "取得エラー"
+        logging.error(f"Row {row_index}: Failed to get image URL. Error: {error_message}")
+        # 画像URLが見つからなくてもD列には "-" が入っている
+    return None
+
+def embed_images(sheet: Worksheet, img_embed_col_idx: int, pending_embeds: List[PendingEmbed]) -> int:
+    """
+    埋め込み待ちの画像を行順にまとめてシートへ追加し、行の高さ・列の幅を一度に調整する。
+    Returns:
+        int: 埋め込みに成功した画像数
+    """
+    t_embed = time.time()
+    img_embed_col_letter = get_column_letter(img_embed_col_idx) # 画像のアンカーと列幅の設定に使う
+    row_heights: Dict[int, float] = {}
+    col_width: Optional[float] = None
+
+    for row_index, image_data_buffer, img_width, img_height in sorted(pending_embeds, key=lambda e: e[0]):
+        img_embed_cell = sheet.cell(row=row_index, column=img_embed_col_idx)
+        try:
+            if image_data_buffer.closed:
+                logging.error(f"Row {row_index}: Image data buffer was closed before embedding.")
+                img_embed_cell.value = "内部エラー(Buffer)"
+                continue
+
+            # --- 画像埋め込み ---
+            img_for_excel = OpenpyxlImage(image_data_buffer)
+            img_for_excel.width = img_width
+            img_for_excel.height = img_height
+
+            # セルのアンカーと配置
+            cell_anchor = f"{img_embed_col_letter}{row_index}"
+            # セルの内容配置を中央揃えに (画像自体のアラインメントではない)
+            img_embed_cell.alignment = CENTER_ALIGNMENT
+
+            sheet.add_image(img_for_excel, cell_anchor)
+            logging.info(f"Row {row_index}: Image successfully embedded into cell {cell_anchor}")
+
+            # 行の高さ・列の幅
+            row_heights[row_index] = img_height * 0.75 + 2 # ポイント単位に変換 + 余白
+            col_width = max(col_width or 0.0, img_width / 7.0 + 1 + 5) # Excelの幅単位に変換 + 余白 (少し余裕を持たせる)
+        except ValueError as ve:
+            # openpyxl がサポートしていない画像形式などの場合
+            logging.error(f"Row {row_index}: Error embedding image (ValueError): {ve}", exc_info=False)
+            img_embed_cell.value = f"画像形式エラー? ({ve})"
+        except Exception as e:
+            logging.error(f"Row {row_index}: Unexpected error embedding image: {e}", exc_info=True)
+            img_embed_cell.value = "画像埋込エラー"
+
+    apply_dimension_updates(sheet, img_embed_col_letter, row_heights, col_width)
+    logging.info(f"Embedded {len(row_heights)}/{len(pending_embeds)} images in {time.time() - t_embed:.3f}s")
+    return len(row_heights)
+
+def apply_dimension_updates(sheet: Worksheet, img_embed_col_letter: str,
+                            row_heights: Dict[int, float], col_width: Optional[float]):
+    """蓄積した行の高さ・列の幅を一度にシートへ反映する (既存値より小さい場合のみ更新)"""
+    row_dimensions = sheet.row_dimensions
+    for row_index, required_row_height in row_heights.items():
+        row_dimension = row_dimensions[row_index] # 存在しない場合はここで1回だけ生成される
+        if row_dimension.height is None or row_dimension.height < required_row_height:
+            row_dimension.height = required_row_height
+            logging.debug(f"Row {row_index}: Set row height to {required_row_height:.2f}")
+
+    if col_width is not None:
+        column_dimension = sheet.column_dimensions[img_embed_col_letter]
+        if column_dimension.width is None or column_dimension.width < col_width:
+            column_dimension.width = col_width
+            logging.debug(f"Set column {img_embed_col_letter} width to {col_width:.2f}")
+
+def collect_target_rows(
     sheet: Worksheet,
     url_col_idx: int,
     img_url_col_idx: int,
-    img_embed_col_letter: str,
-    hyphen_col_letter: str,
-    image_width: int,
-    sleep_interval: float,
+    hyphen_col_idx: int,
     process_all_rows: bool,
-    driver: Optional[webdriver.Chrome]
-) -> int:
-    """Excelの各行を処理し、画像を取得・埋め込みを行う"""
-    processed_count = 0
+    url_values: List[Any]
+) -> List[Tuple[int, str]]:
+    """
+    処理対象の (行番号, URL) を収集する。url_values は2行目以降のURL列の値。
+    無効なURL形式の行にはエラーを書き込み、処理対象の行にはD列のハイフンを設定する。
+    """
     start_row = 2 # ヘッダー行の次から開始
-    img_embed_col_idx = openpyxl.utils.column_index_from_string(img_embed_col_letter)
-    hyphen_col_idx = openpyxl.utils.column_index_from_string(hyphen_col_letter)
+    target_rows: List[Tuple[int, str]] = []
+    debug_enabled = logging.getLogger().isEnabledFor(logging.DEBUG) # 空行ごとのログの組み立てを省くため
 
-    total_rows_with_urls = sum(1 for row_idx in range(start_row, sheet.max_row + 1)
-                               if sheet.cell(row=row_idx, column=url_col_idx).value)
-    print(f"処理対象のURLを含む行数: {total_rows_with_urls}")
-    if total_rows_with_urls == 0:
-        print("処理対象のURLが見つかりませんでした。")
-        return 0
-
-    overall_start_time = time.time() # ループ開始時間
-
-    for row_index in range(start_row, sheet.max_row + 1):
-        url_cell = sheet.cell(row=row_index, column=url_col_idx)
-        url = str(url_cell.value).strip() if url_cell.value is not None else ""
+    for row_index, url_value in enumerate(url_values, start=start_row):
+        url = str(url_value).strip() if url_value is not None else ""
 
         # URLがない場合
         if not url:
             if not process_all_rows:
-                logging.debug(f"Row {row_index}: Skipping empty URL.")
+                if debug_enabled:
+                    logging.debug(f"Row {row_index}: Skipping empty URL.")
                 continue # process_all=False ならスキップ
             else:
                 print(f"\n行 {row_index}: URLが空のため処理を中断します。")
@@ -798,7 +1692,7 @@ def process_excel_rows(
                 break # process_all=True なら中断
 
         # URL形式チェック
-        if not url.lower().startswith(('http://', 'https://')):
+        if not url[:8].lower().startswith(HTTP_URL_PREFIXES):
             logging.warning(f"Row {row_index}: Invalid URL format: {url}")
             error_msg = "無効なURL形式"
             sheet.cell(row=row_index, column=img_url_col_idx).value = error_msg
@@ -811,95 +1705,119 @@ def process_excel_rows(
             else:
                  continue # 次の行へ
 
-        # --- ここから有効なURLの処理 ---
-        processed_count += 1
-        print(f"\r処理中: {processed_count}/{total_rows_with_urls} 件目 ({row_index}行目) - {url[:60]}...", end="", flush=True)
-        logging.info(f"--- Processing Row {row_index}, URL: {url} ---")
-
         # D列にハイフンを設定
         sheet.cell(row=row_index, column=hyphen_col_idx).value = "-"
+        target_rows.append((row_index, url))
 
-        # 画像URLを取得
-        image_url, error_message = get_image_url_from_url(url, driver)
-
-        img_url_cell = sheet.cell(row=row_index, column=img_url_col_idx)
-        img_embed_cell = sheet.cell(row=row_index, column=img_embed_col_idx)
+    return target_rows
 
-        if image_url:
-            img_url_cell.value = image_url
-            # ハイパーリンクを設定（Excelの制限に注意）
-            try:
-                 img_url_cell.hyperlink = image_url
-                 img_url_cell.style = "Hyperlink"
-            except Exception as e:
-                 logging.warning(f"Row {row_index}: Failed to set hyperlink for image URL: {e}")
-
-            # 画像をダウンロードして準備
-            image_result = download_and_prepare_image(image_url, image_width, referrer_url=url)
-
-            if image_result:
-                image_data_buffer, img_width, img_height = image_result
-                try:
-                    if not image_data_buffer.closed:
-                        # --- 画像埋め込み ---
-                        img_for_excel = OpenpyxlImage(image_data_buffer)
-                        img_for_excel.width = img_width
-                        img_for_excel.height = img_height
-
-                        # 行の高さ調整
-                        required_row_height = img_height * 0.75 + 2 # ポイント単位に変換 + 余白
-                        current_height = sheet.row_dimensions[row_index].height
-                        if current_height is None or current_height < required_row_height:
-                            sheet.row_dimensions[row_index].height = required_row_height
-                            logging.debug(f"Row {row_index}: Set row height to {required_row_height:.2f}")
-
-                        # 列の幅調整 (初回のみ or 必要なら毎回)
-                        col_letter = img_embed_col_letter
-                        required_col_width = img_width / 7.0 + 1 # Excelの幅単位に変換 + 余白 (調整が必要かも)
-                        current_width = sheet.column_dimensions[col_letter].width
-                        # 常に上書きする or 未設定か小さい場合のみ設定するか選択
-                        # if current_width is None or current_width < required_col_width:
-                        if current_width is None or current_width < required_col_width + 5: # 少し余裕を持たせる
-                            sheet.column_dimensions[col_letter].width = required_col_width + 5
-                            logging.debug(f"Row {row_index}: Set column {col_letter} width to {required_col_width + 5:.2f}")
-
-
-                        # セルのアンカーと配置
-                        cell_anchor = f"{img_embed_col_letter}{row_index}"
-                        # セルの内容配置を中央揃えに (画像自体のアラインメントではない)
-                        img_embed_cell.alignment = Alignment(horizontal='center', vertical='center')
-
-                        sheet.add_image(img_for_excel, cell_anchor)
-                        logging.info(f"Row {row_index}: Image successfully embedded into cell {cell_anchor}")
-                    else:
-                        logging.error(f"Row {row_index}: Image data buffer was closed before embedding.")
-                        img_embed_cell.value = "内部エラー(Buffer)"
-                except ValueError as ve:
-                    # openpyxl がサポートしていない画像形式などの場合
-                    logging.error(f"Row {row_index}: Error embedding image (ValueError): {ve}", exc_info=False)
-                    img_embed_cell.value = f"画像形式エラー? ({ve})"
-                except Exception as e:
-                    logging.error(f"Row {row_index}: Unexpected error embedding image: {e}", exc_info=True)
-                    img_embed_cell.value = "画像埋込エラー"
+def process_excel_rows(
+    sheet: Worksheet,
+    url_col_idx: int,
+    img_url_col_idx: int,
+    img_embed_col_idx: int,
+    hyphen_col_idx: int,
+    image_width: int,
+    sleep_interval: float,
+    process_all_rows: bool,
+    driver_manager: Optional[WebDriverManager],
+    session: Optional[requests.Session] = None,
+    max_workers: int = MAX_WORKERS,
+    url_values: Optional[List[Any]] = None
+) -> int:
+    """
+    Excelの各行を処理し、画像を取得・埋め込みを行う。
+    ネットワーク処理はスレッドプールで並列実行し、シートへの書き込みはメインスレッドで行う
+    (openpyxl はスレッドセーフではないため)。
+    url_values (read_url_column の結果) を渡すと、URL列をシートから走査し直さない。
+    """
+    processed_count = 0
+    start_row = 2 # ヘッダー行の次から開始
 
-            else:
-                # 画像ダウンロード/処理失敗
-                logging.warning(f"Row {row_index}: Failed to download or prepare image from URL: {image_url}")
-                img_embed_cell.value = "画像DL/処理失敗"
-        else:
-            # 画像URL取得失敗
-            img_url_cell.value = error_message if error_message else "取得エラー"
-            logging.error(f"Row {row_index}: Failed to get image URL. Error: {error_message}")
-            # 画像URLが見つからなくてもD列には "-" が入っている
+    if url_values is None:
+        url_values = [value for (value,) in sheet.iter_rows(min_row=start_row, min_col=url_col_idx,
+                                                            max_col=url_col_idx, values_only=True)]
+    total_rows_with_urls = sum(1 for value in url_values if value is not None and str(value).strip())
+    print(f"処理対象のURLを含む行数: {total_rows_with_urls}")
+    if total_rows_with_urls == 0:
+        print("処理対象のURLが見つかりませんでした。")
+        return 0
 
-        # 1行処理完了表示
-        current_elapsed_time = time.time() - overall_start_time
-        print(f"\r処理完了: {processed_count}/{total_rows_with_urls} 件目 ({row_index}行目) - {url[:60]}... (経過: {current_elapsed_time:.1f} 秒)      ", flush=True)
+    target_rows = collect_target_rows(sheet, url_col_idx, img_url_col_idx, hyphen_col_idx, process_all_rows, url_values)
+    total_targets = len(target_rows)
+    workers = max(1, min(max_workers, total_targets)) if total_targets else 1
+    logging.info(f"Processing {total_targets} rows with {workers} worker thread(s).")
 
-        # 待機
-        if sleep_interval > 0:
-            logging.debug(f"Sleeping for {sleep_interval} seconds...")
-            time.sleep(sleep_interval)
+    rate_limiter = HostRateLimiter(sleep_interval) if sleep_interval > 0 else None
+    overall_start_time = time.time() # ループ開始時間
+    pending_embeds: List[PendingEmbed] = []
+
+    # tqdm があれば進捗バーで表示 (描画は約10Hzにまとめられる)。なければ PROGRESS_PRINT_INTERVAL ごとに1行で表示
+    progress = tqdm(total=total_targets, desc="処理中", unit="件", dynamic_ncols=True) if tqdm else None
+    last_print_time = 0.0
+
+    # 最初からSeleniumを使うドメインの行は、WebDriverの数と同じスレッド数の専用プールで処理する
+    # (ワーカースレッドがWebDriverの空き待ちで塞がり、requests の行が止まるのを防ぐ)。
+    # 実行中にSeleniumが必要と学習したドメインの行は、requests 用のワーカーが RerouteToSelenium で差し戻した時点で専用プールに回す
+    selenium_workers = driver_manager.pool_size if driver_manager else 1
+    with ThreadPoolExecutor(max_workers=workers) as executor, \
+            ThreadPoolExecutor(max_workers=selenium_workers, thread_name_prefix="selenium") as selenium_executor:
+        futures: Dict[Future, Tuple[int, str]] = {}
+        for row_index, url in target_rows:
+            if driver_manager and requires_selenium(get_domain(url)):
+                future = selenium_executor.submit(fetch_and_prepare_row, url, image_width, rate_limiter, driver_manager, session)
+            else:
+                future = executor.submit(fetch_and_prepare_row, url, image_width, rate_limiter, driver_manager, session,
+                                         reroute_learned_selenium=True)
+            futures[future] = (row_index, url)
+        try:
+            not_done = set(futures)
+            while not_done:
+                done, not_done = wait(not_done, return_when=FIRST_COMPLETED)
+                for future in done:
+                    row_index, url = futures.pop(future)
+                    try:
+                        image_url, error_message, image_result = future.result()
+                    except RerouteToSelenium:
+                        logging.info(f"Row {row_index}: Domain was learned to need Selenium. Moving to the Selenium pool: {url}")
+                        rerouted = selenium_executor.submit(fetch_and_prepare_row, url, image_width, rate_limiter,
+                                                            driver_manager, session)
+                        futures[rerouted] = (row_index, url)
+                        not_done.add(rerouted)
+                        continue
+                    except Exception as e:
+                        logging.error(f"Row {row_index}: Unexpected error in worker: {e}", exc_info=True)
+                        image_url, error_message, image_result = None, f"エラー: {str(e)[:50]}", None
+                    processed_count += 1
+                    logging.info(f"--- Processing Row {row_index}, URL: {url} ---")
+
+                    pending = write_row_result(sheet, row_index, img_url_col_idx, img_embed_col_idx,
+                                               image_url, error_message, image_result)
+                    if pending:
+                        pending_embeds.append(pending)
+
+                    # 1行処理完了表示
+                    if progress:
+                        progress.set_postfix_str(f"{row_index}行目", refresh=False)
+                        progress.update(1)
+                    elif processed_count == total_targets or time.time() - last_print_time >= PROGRESS_PRINT_INTERVAL:
+                        last_print_time = time.time()
+                        current_elapsed_time = last_print_time - overall_start_time
+                        print(f"\r処理完了: {processed_count}/{total_targets} 件目 ({row_index}行目) - {url[:60]}... (経過: {current_elapsed_time:.1f} 秒)      ", flush=True)
+        except KeyboardInterrupt:
+            # 未着手の行を取り消して中断する (with の終了時に、キューに残った全行の処理完了を待たないようにする)
+            print("\n中断しています... (実行中の行の完了を待っています)")
+            logging.warning("Interrupted. Cancelling rows that have not started yet.")
+            executor.shutdown(wait=False, cancel_futures=True)
+            selenium_executor.shutdown(wait=False, cancel_futures=True)
+            if progress:
+                progress.close()
+            raise
+
+    if progress:
+        progress.close()
+
+    embed_images(sheet, img_embed_col_idx, pending_embeds)
 
     print() # 最後の行の表示をクリアするための改行
     if processed_count == 0 and total_rows_with_urls > 0:
@@ -929,8 +1847,8 @@ def save_workbook(workbook: Workbook, file_path: str):
 # ============================================
 # 7. ロギング設定
 # ============================================
-def setup_logging(debug_mode: bool):
-    """ロギングを設定する"""
+def setup_logging(debug_mode: bool, reset_log_file: bool = True):
+    """ロギングを設定する (reset_log_file=False の場合、既存のデバッグログに追記する)"""
     log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - [%(funcName)s:%(lineno)d] - %(message)s')
     logger = logging.getLogger()
     logger.handlers.clear() # 既存のハンドラをクリア
@@ -947,14 +1865,15 @@ def setup_logging(debug_mode: bool):
     if debug_mode:
         try:
             # 既存のログファイルがあれば削除
-            if os.path.exists(DEBUG_LOG_FILE):
+            if reset_log_file and os.path.exists(DEBUG_LOG_FILE):
                 os.remove(DEBUG_LOG_FILE)
-            file_handler = logging.FileHandler(DEBUG_LOG_FILE, mode='w', encoding='utf-8')
+            file_handler = logging.FileHandler(DEBUG_LOG_FILE, mode='w' if reset_log_file else 'a', encoding='utf-8')
             file_handler.setFormatter(log_formatter)
             file_handler.setLevel(logging.DEBUG) # ファイルにはDEBUGレベルまで記録
             logger.addHandler(file_handler)
             logger.setLevel(logging.DEBUG) # ロガー全体のレベルをDEBUGに設定
-            print(f"デバッグログが有効です。ログファイル: '{DEBUG_LOG_FILE}'")
+            if reset_log_file:
+                print(f"デバッグログが有効です。ログファイル: '{DEBUG_LOG_FILE}'")
         except Exception as e:
             logging.error(f"デバッグログファイル '{DEBUG_LOG_FILE}' の準備に失敗しました: {e}")
             # ファイルハンドラが設定できなくてもコンソールには出力されるようにする
@@ -984,7 +1903,15 @@ def main():
     parser.add_argument('--width', type=int, default=DEFAULT_IMAGE_WIDTH,
                         help='埋め込む画像の幅 (px)')
     parser.add_argument('--sleep', type=float, default=POST_URL_SLEEP,
-                        help='各URL処理後の待機時間 (秒)')
+                        help='同一ホストへのアクセス間隔 (秒)')
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS,
+                        help='URL取得・画像ダウンロードを並列実行するスレッド数 (1で逐次処理)')
+    parser.add_argument('--processes', type=int, default=CPU_PROCESSES,
+                        help='HTML解析・画像リサイズを実行するプロセス数 (0でワーカースレッド内で実行)')
+    parser.add_argument('--drivers', type=int, default=SELENIUM_DRIVERS,
+                        help='同時に起動するChrome (WebDriver) の最大数。Seleniumが必要な行を並列に処理する')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='HTTPレスポンスと解析結果のディスクキャッシュを使用しない')
     parser.add_argument('--all', action='store_true', dest='process_all',
                         help='URL列が空になった時点で処理を中断せずに、ファイルの最後まで処理を試みる')
     parser.add_argument('--skip-selenium', action='store_true',
@@ -1000,61 +1927,65 @@ def main():
 
     workbook: Optional[Workbook] = None
     sheet: Optional[Worksheet] = None
+    session: Optional[requests.Session] = None
     processed_count = 0
 
     try:
-        # --- Excelファイルの読み込みとシート選択 ---
-        workbook, sheet = load_workbook_and_sheet(args.input_file, args.sheet)
-        if not workbook or not sheet:
+        # --- シート選択・ヘッダー解析・URL列の読み取り (読み取り専用モードで高速に走査) ---
+        # 編集用の読み込み (全セルをメモリに展開する) は、処理対象のURLがある場合だけ行う
+        workbook_ro, sheet_ro = load_workbook_and_sheet(args.input_file, args.sheet, read_only=True)
+        if not workbook_ro or not sheet_ro:
             return # エラーメッセージは load_workbook_and_sheet 内で表示済み
-
-        # --- ヘッダー解析と列インデックス取得 ---
-        required_headers = [URL_HEADER_NAME, IMAGE_URL_HEADER_NAME]
-        col_indices = get_column_indices(sheet, required_headers)
-        if not col_indices:
-            return # エラーメッセージは get_column_indices 内で表示済み
+        try:
+            required_headers = [URL_HEADER_NAME, IMAGE_URL_HEADER_NAME]
+            col_indices = get_column_indices(sheet_ro, required_headers)
+            if not col_indices:
+                return # エラーメッセージは get_column_indices 内で表示済み
+            sheet_title = sheet_ro.title
+            url_values = read_url_column(sheet_ro, col_indices[URL_HEADER_NAME])
+        finally:
+            workbook_ro.close()
 
         url_col_idx = col_indices[URL_HEADER_NAME]
         img_url_col_idx = col_indices[IMAGE_URL_HEADER_NAME]
 
-        # --- 固定列の確認と表示 ---
-        try:
-            openpyxl.utils.column_index_from_string(IMAGE_EMBED_COL_LETTER)
-            openpyxl.utils.column_index_from_string(HYPHEN_COL_LETTER)
-            print(f"使用列: URL='{URL_HEADER_NAME}' ({get_column_letter(url_col_idx)}), "
-                  f"ImgURL='{IMAGE_URL_HEADER_NAME}' ({get_column_letter(img_url_col_idx)}), "
-                  f"ImgEmbed={IMAGE_EMBED_COL_LETTER}, Hyphen={HYPHEN_COL_LETTER}")
-        except ValueError:
-            print(f"エラー: 固定列名 ({IMAGE_EMBED_COL_LETTER}, {HYPHEN_COL_LETTER}) が無効です。")
-            logging.error(f"Invalid fixed column letters: {IMAGE_EMBED_COL_LETTER}, {HYPHEN_COL_LETTER}")
+        if url_values is not None and not any(value is not None and str(value).strip() for value in url_values):
+            print("処理対象のURLが見つかりませんでした。ファイルは変更しません。")
+            logging.info("No URLs found in the read-only scan. Skipping workbook load and save.")
             return
 
+        # --- 編集用にExcelファイルを読み込む ---
+        workbook, sheet = load_workbook_and_sheet(args.input_file, sheet_title)
+        if not workbook or not sheet:
+            return
+
+        # --- 使用列の表示 (固定列の列番号は起動時に変換済み) ---
+        print(f"使用列: URL='{URL_HEADER_NAME}' ({get_column_letter(url_col_idx)}), "
+              f"ImgURL='{IMAGE_URL_HEADER_NAME}' ({get_column_letter(img_url_col_idx)}), "
+              f"ImgEmbed={IMAGE_EMBED_COL_LETTER}, Hyphen={HYPHEN_COL_LETTER}")
+
         # --- 既存結果のクリア ---
-        clear_previous_results(sheet, url_col_idx, img_url_col_idx, IMAGE_EMBED_COL_LETTER, HYPHEN_COL_LETTER)
+        clear_previous_results(sheet, url_col_idx, img_url_col_idx, IMAGE_EMBED_COL_IDX, HYPHEN_COL_IDX)
+
+        # --- CPU処理用プロセスプールの準備 (--processes 指定時) ---
+        start_cpu_pool(args.processes, args.debug)
+
+        # --- HTTPセッションの準備 (全URLでコネクションを再利用) ---
+        session = create_http_session(max(HTTP_POOL_SIZE, args.workers), use_cache=not args.no_cache)
+        if not args.no_cache:
+            open_result_cache()
 
         # --- WebDriverの準備 (必要な場合) ---
-        driver: Optional[webdriver.Chrome] = None
         if not args.skip_selenium:
             # WebDriverManagerを `with` 文で使い、初期化と終了を自動管理
-            with WebDriverManager() as managed_driver:
-                if managed_driver:
-                    driver = managed_driver # 正常に初期化された場合
-                    # --- Excel行処理の実行 ---
-                    processed_count = process_excel_rows(
-                        sheet, url_col_idx, img_url_col_idx,
-                        IMAGE_EMBED_COL_LETTER, HYPHEN_COL_LETTER,
-                        args.width, args.sleep, args.process_all, driver
-                    )
-                else:
-                    # WebDriverの初期化に失敗した場合
-                    print("警告: WebDriverの初期化に失敗したため、Seleniumを利用した処理はスキップされます。")
-                    logging.warning("WebDriver initialization failed. Selenium-dependent operations will be skipped.")
-                    # Seleniumなしで処理を試みる
-                    processed_count = process_excel_rows(
-                        sheet, url_col_idx, img_url_col_idx,
-                        IMAGE_EMBED_COL_LETTER, HYPHEN_COL_LETTER,
-                        args.width, args.sleep, args.process_all, None # driver=Noneを渡す
-                    )
+            # (Chromeは最初にSeleniumが必要になった時点で起動される。起動に失敗した行はrequestsの結果のみになる)
+            with WebDriverManager(args.drivers) as driver_manager:
+                # --- Excel行処理の実行 ---
+                processed_count = process_excel_rows(
+                    sheet, url_col_idx, img_url_col_idx,
+                    IMAGE_EMBED_COL_IDX, HYPHEN_COL_IDX,
+                    args.width, args.sleep, args.process_all, driver_manager, session, args.workers, url_values
+                )
         else:
             # --skip-seleniumが指定された場合
             print("Seleniumの使用はスキップされました (--skip-selenium)。")
@@ -1062,8 +1993,8 @@ def main():
             # --- Excel行処理の実行 (Seleniumなし) ---
             processed_count = process_excel_rows(
                 sheet, url_col_idx, img_url_col_idx,
-                IMAGE_EMBED_COL_LETTER, HYPHEN_COL_LETTER,
-                args.width, args.sleep, args.process_all, None # driver=None
+                IMAGE_EMBED_COL_IDX, HYPHEN_COL_IDX,
+                args.width, args.sleep, args.process_all, None, session, args.workers, url_values # driver_manager=None
             )
 
         # --- ワークブックの保存 ---
@@ -1105,6 +2036,17 @@ def main():
         logging.exception("An unexpected error occurred in the main execution block.")
 
     finally:
+        # --- プロセスプールを終了 ---
+        shutdown_cpu_pool()
+
+        # --- 解析結果キャッシュを閉じる ---
+        close_result_cache()
+
+        # --- HTTPセッションを閉じる ---
+        if session:
+            session.close()
+            logging.info("HTTP session closed.")
+
         # --- ワークブックを閉じる ---
         if workbook:
             try:
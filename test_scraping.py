@@ -0,0 +1,377 @@
+import threading
+import time
+from io import BytesIO
+
+import openpyxl
+import pytest
+import requests
+from bs4 import BeautifulSoup
+from PIL import Image
+
+import scraping
+
+requires_orjson = pytest.mark.skipif(scraping.orjson is None, reason="orjson is not installed")
+
+LD_JSON_HTML = (
+    '<html><head><script type="application/ld+json">{"image": "https://example.com/item.jpg"}</script>'
+    '</head><body></body></html>'
+)
+MERCARI_HTML = (
+    '<html><head><script id="__NEXT_DATA__" type="application/json">'
+    '{"props": {"pageProps": {"item": {"photos": ["https://static.mercdn.net/item/detail/orig/photos/m1_1.jpg"]}}}}'
+    '</script></head><body></body></html>'
+)
+EMPTY_OG_IMAGE_HTML = (
+    '<html><head><meta property="og:image" content=""><meta property="og:image" content="https://example.com/second.jpg">'
+    '<meta name="twitter:image" content="https://example.com/twitter.jpg"></head><body></body></html>'
+)
+
+NO_IMAGE_HTML_CASES = {
+    "empty_og_image": '<html><head><meta property="og:image" content=""></head><body></body></html>',
+    "og_image_width_only": '<html><head><meta property="og:image:width" content="1200"></head><body></body></html>',
+    "next_data_only": '<html><head><script id="__NEXT_DATA__" type="application/json">{"props": {}}</script></head><body></body></html>',
+}
+
+
+def make_response(url, html, content_type="text/html"):
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response._content = html.encode("utf-8") if isinstance(html, str) else html
+    response.headers["content-type"] = content_type
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    return response
+
+
+class StubSession:
+    def __init__(self, html):
+        self.html = html
+
+    def get(self, url, **kwargs):
+        return make_response(url, self.html)
+
+
+class StubDriverManager:
+    pool_size = 1
+
+    def is_available(self):
+        return True
+
+    def acquire_driver(self):
+        return object()
+
+    def release_driver(self, driver):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def reset_selenium_state(monkeypatch):
+    monkeypatch.setattr(scraping, "_selenium_preferred_domains", {})
+    monkeypatch.setattr(scraping, "_selenium_result_cache", {})
+
+
+@requires_orjson
+def test_json_loads_accepts_str_subclasses():
+    soup = BeautifulSoup(LD_JSON_HTML, "html.parser")
+    assert scraping.json_loads(soup.script.string) == {"image": "https://example.com/item.jpg"}
+
+
+@requires_orjson
+def test_json_ld_image_with_soup_backend(monkeypatch):
+    monkeypatch.setattr(scraping, "LexborHTMLParser", None)
+    monkeypatch.setattr(scraping, "lxml_html", None)
+    assert scraping.parse_html_for_image(LD_JSON_HTML, "https://example.com/p", "example.com") == "https://example.com/item.jpg"
+
+
+@requires_orjson
+@pytest.mark.skipif(scraping.lxml_html is None, reason="lxml is not installed")
+def test_json_ld_image_with_lxml_backend(monkeypatch):
+    monkeypatch.setattr(scraping, "LexborHTMLParser", None)
+    assert scraping.parse_html_for_image_fast(LD_JSON_HTML, "https://example.com/p", "example.com") == ("https://example.com/item.jpg", False)
+
+
+@requires_orjson
+def test_mercari_next_data_from_soup():
+    soup = BeautifulSoup(MERCARI_HTML, "html.parser")
+    assert scraping._parse_mercari_image(soup) == "https://static.mercdn.net/item/detail/orig/photos/m1_1.jpg"
+
+
+def test_empty_first_og_image_falls_through_to_twitter_image_on_every_backend():
+    candidates = [scraping._soup_candidates(BeautifulSoup(EMPTY_OG_IMAGE_HTML, "html.parser"))]
+    if scraping.lxml_html is not None:
+        candidates.append(scraping._lxml_candidates(EMPTY_OG_IMAGE_HTML))
+    if scraping.LexborHTMLParser is not None:
+        candidates.append(scraping._lexbor_candidates(EMPTY_OG_IMAGE_HTML))
+    for candidate in candidates:
+        assert scraping._select_image_from_candidates(candidate, "example.com") == ("https://example.com/twitter.jpg", True)
+
+
+@pytest.mark.parametrize("html", NO_IMAGE_HTML_CASES.values(), ids=NO_IMAGE_HTML_CASES.keys())
+def test_selenium_retry_when_static_html_has_no_image_url(monkeypatch, html):
+    selenium_calls = []
+
+    def fake_selenium(driver_manager, url):
+        selenium_calls.append(url)
+        return "https://example.com/rendered.jpg"
+
+    monkeypatch.setattr(scraping, "_get_image_url_with_selenium", fake_selenium)
+    url = "https://example.com/item"
+    image_url, error_message = scraping._fetch_image_url_from_url(url, StubDriverManager(), StubSession(html))
+    assert selenium_calls == [url]
+    assert (image_url, error_message) == ("https://example.com/rendered.jpg", None)
+
+
+def test_selenium_result_cache_keeps_only_found_images(monkeypatch):
+    results = iter([None, "https://example.com/rendered.jpg"])
+    monkeypatch.setattr(scraping, "_get_image_url_with_driver", lambda driver, url: next(results))
+    url = "https://example.com/item"
+    assert scraping._get_image_url_with_selenium(StubDriverManager(), url) is None
+    assert url not in scraping._selenium_result_cache
+    assert scraping._get_image_url_with_selenium(StubDriverManager(), url) == "https://example.com/rendered.jpg"
+    assert scraping._get_image_url_with_selenium(StubDriverManager(), url) == "https://example.com/rendered.jpg"
+
+
+def test_prefers_selenium_after_learn_threshold():
+    for _ in range(scraping.SELENIUM_LEARN_THRESHOLD - 1):
+        scraping.record_selenium_outcome("example.com", selenium_needed=True)
+    assert not scraping.prefers_selenium("example.com")
+    scraping.record_selenium_outcome("example.com", selenium_needed=True)
+    assert scraping.prefers_selenium("example.com")
+    assert not scraping.prefers_selenium("example.org")
+
+
+def test_record_selenium_outcome_unlearns_on_miss():
+    for _ in range(scraping.SELENIUM_LEARN_THRESHOLD):
+        scraping.record_selenium_outcome("example.com", selenium_needed=True)
+    scraping.record_selenium_outcome("example.com", selenium_needed=False)
+    assert not scraping.prefers_selenium("example.com")
+    scraping.record_selenium_outcome("example.com", selenium_needed=True)
+    assert not scraping.prefers_selenium("example.com")
+
+
+def test_learned_selenium_rows_run_on_selenium_pool(monkeypatch):
+    for _ in range(scraping.SELENIUM_LEARN_THRESHOLD):
+        scraping.record_selenium_outcome("learned.example.com", selenium_needed=True)
+    thread_names = {}
+
+    def fake_get_image_url(url, driver_manager=None, session=None, *args, **kwargs):
+        thread_names[url] = threading.current_thread().name
+        return None, "not found"
+
+    monkeypatch.setattr(scraping, "get_image_url_from_url", fake_get_image_url)
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(["URL", "(work)画像URL"])
+    sheet.append(["https://learned.example.com/item"])
+    sheet.append(["https://other.example.com/item"])
+    processed = scraping.process_excel_rows(sheet, 1, 2, scraping.IMAGE_EMBED_COL_IDX, scraping.HYPHEN_COL_IDX,
+                                            100, 0, False, StubDriverManager(), max_workers=2)
+    assert processed == 2
+    assert thread_names["https://learned.example.com/item"].startswith("selenium")
+    assert not thread_names["https://other.example.com/item"].startswith("selenium")
+
+
+class RecordingRateLimiter:
+    def __init__(self):
+        self.hosts = []
+
+    def wait(self, host):
+        self.hosts.append(host)
+
+
+def test_rate_limit_only_on_result_cache_miss(monkeypatch):
+    monkeypatch.setattr(scraping, "result_cache_get",
+                        lambda url: "https://example.com/cached.jpg" if url.endswith("/cached") else None)
+    monkeypatch.setattr(scraping, "_fetch_image_url_from_url", lambda url, driver_manager, session: (None, "not found"))
+    rate_limiter = RecordingRateLimiter()
+    assert scraping.get_image_url_from_url("https://example.com/cached", rate_limiter=rate_limiter) == ("https://example.com/cached.jpg", None)
+    assert rate_limiter.hosts == []
+    assert scraping.get_image_url_from_url("https://example.com/new", rate_limiter=rate_limiter) == (None, "not found")
+    assert rate_limiter.hosts == ["example.com"]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+
+
+def test_host_rate_limiter_spaces_same_host(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(scraping.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(scraping.time, "sleep", clock.sleep)
+    rate_limiter = scraping.HostRateLimiter(2.0)
+    rate_limiter.wait("example.com")
+    rate_limiter.wait("example.com")
+    rate_limiter.wait("example.com")
+    assert clock.sleeps == [2.0, 4.0]
+    clock.now += 10.0
+    rate_limiter.wait("example.com")
+    assert clock.sleeps == [2.0, 4.0]
+
+
+def test_host_rate_limiter_does_not_wait_across_hosts(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(scraping.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(scraping.time, "sleep", clock.sleep)
+    rate_limiter = scraping.HostRateLimiter(2.0)
+    rate_limiter.wait("example.com")
+    rate_limiter.wait("example.org")
+    rate_limiter.wait("example.net")
+    assert clock.sleeps == []
+
+
+def test_detect_html_encoding_prefers_header_charset():
+    html = '<html><head><meta charset="Shift_JIS"></head><body>商品</body></html>'.encode("euc_jp")
+    response = make_response("https://example.com/", html, "text/html; charset=EUC-JP")
+    assert scraping.detect_html_encoding(response).lower() == "euc-jp"
+
+
+@pytest.mark.parametrize("charset, meta", [
+    ("shift_jis", '<meta charset="Shift_JIS">'),
+    ("euc_jp", '<meta http-equiv="Content-Type" content="text/html; charset=EUC-JP">'),
+])
+def test_detect_html_encoding_from_meta_charset(charset, meta):
+    html = f'<html><head>{meta}<title>商品画像</title></head><body></body></html>'.encode(charset)
+    response = make_response("https://example.com/", html)
+    response.encoding = scraping.detect_html_encoding(response)
+    assert "商品画像" in response.text
+
+
+@pytest.mark.parametrize("html", [
+    '<html><head><title>商品</title></head></html>',
+    '<html><head><meta charset="x-unknown-charset"><title>商品</title></head></html>',
+])
+def test_detect_html_encoding_falls_back_to_utf8(html):
+    response = make_response("https://example.com/", html.encode("utf-8"))
+    assert scraping.detect_html_encoding(response) == "utf-8"
+
+
+def encode_image(image, image_format):
+    buffer = BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def test_resize_passthrough_returns_original_bytes():
+    raw = encode_image(Image.new("RGB", (104, 50), "red"), "JPEG")
+    assert scraping.resize_image_bytes(raw, 100) == (raw, 100, 48)
+
+
+def test_resize_large_jpeg_to_target_width():
+    raw = encode_image(Image.new("RGB", (1600, 800), "red"), "JPEG")
+    data, width, height = scraping.resize_image_bytes(raw, 100)
+    with Image.open(BytesIO(data)) as resized:
+        assert resized.format == "JPEG"
+        assert resized.size == (width, height) == (100, 50)
+
+
+def test_resize_cmyk_jpeg_is_converted_to_rgb():
+    raw = encode_image(Image.new("CMYK", (400, 200), (0, 255, 255, 0)), "JPEG")
+    data, width, height = scraping.resize_image_bytes(raw, 100)
+    with Image.open(BytesIO(data)) as resized:
+        assert resized.mode == "RGB"
+        assert resized.size == (width, height) == (100, 50)
+
+
+def test_resize_palette_png_keeps_transparency():
+    image = Image.new("P", (400, 200), 0)
+    image.putpalette([255, 0, 0, 0, 0, 255] + [0] * 762)
+    image.paste(1, (200, 0, 400, 200))
+    image.info["transparency"] = 0
+    data, width, height = scraping.resize_image_bytes(encode_image(image, "PNG"), 100)
+    with Image.open(BytesIO(data)) as resized:
+        assert resized.format == "PNG"
+        assert resized.mode == "RGBA"
+        assert resized.size == (width, height) == (100, 50)
+        assert resized.getpixel((10, 25))[3] == 0
+        assert resized.getpixel((90, 25)) == (0, 0, 255, 255)
+
+
+class StubDriver:
+    def __init__(self):
+        self.quit_called = False
+
+    def quit(self):
+        self.quit_called = True
+
+
+class StubDriverFactory:
+    def __init__(self, fail=False, delay=0.0):
+        self.fail = fail
+        self.delay = delay
+        self.created = []
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        time.sleep(self.delay)
+        if self.fail:
+            return None
+        driver = StubDriver()
+        with self._lock:
+            self.created.append(driver)
+        return driver
+
+
+def make_driver_manager(monkeypatch, factory, pool_size):
+    manager = scraping.WebDriverManager(pool_size=pool_size)
+    monkeypatch.setattr(manager, "_start_driver", factory)
+    return manager
+
+
+def run_in_threads(target, count):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    assert not any(thread.is_alive() for thread in threads)
+
+
+def test_driver_pool_never_exceeds_pool_size(monkeypatch):
+    factory = StubDriverFactory(delay=0.05)
+    manager = make_driver_manager(monkeypatch, factory, pool_size=2)
+    in_use = set()
+    max_in_use = []
+    lock = threading.Lock()
+
+    def borrow():
+        driver = manager.acquire_driver()
+        assert driver is not None
+        with lock:
+            in_use.add(driver)
+            max_in_use.append(len(in_use))
+        time.sleep(0.02)
+        with lock:
+            in_use.discard(driver)
+        manager.release_driver(driver)
+
+    run_in_threads(borrow, 8)
+    assert len(factory.created) == 2
+    assert max(max_in_use) <= 2
+
+
+def test_restart_driver_replaces_lost_driver(monkeypatch):
+    factory = StubDriverFactory()
+    manager = make_driver_manager(monkeypatch, factory, pool_size=1)
+    lost = manager.acquire_driver()
+    fresh = manager.restart_driver(lost)
+    assert lost.quit_called
+    assert fresh is not None and fresh is not lost
+    assert manager._drivers == [fresh]
+    manager.release_driver(fresh)
+    assert manager.acquire_driver() is fresh
+
+
+def test_failed_driver_startup_releases_waiting_acquirers(monkeypatch):
+    manager = make_driver_manager(monkeypatch, StubDriverFactory(fail=True, delay=0.2), pool_size=1)
+    results = []
+    run_in_threads(lambda: results.append(manager.acquire_driver()), 3)
+    assert results == [None, None, None]
+    assert not manager.is_available()